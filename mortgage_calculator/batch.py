@@ -0,0 +1,295 @@
+"""
+Batched simulation engine. Runs many Inputs at once by advancing every scenario one month at a
+time as a single (n_scenarios x n_months) array computation, instead of calling
+get_all_simulation_data once per scenario. n_months covers the longest horizon of the scenarios,
+and the results are NaN past the horizon of each scenario.
+
+The month loop mirrors the reference loop get_monthly_sim_loop step for step, with the per
+scenario branches (extra payment clamping, PMI cancellation) replaced by masks, so results match
+the scalar path within floating point tolerance.
+"""
+
+from dataclasses import fields
+from types import SimpleNamespace
+
+import numpy as np
+
+from mortgage_calculator.calculator import (
+    Inputs,
+    MONTHLY_COLUMNS,
+    get_yearly_agg_arrays,
+    yearly_arrays_to_df,
+    get_extra_payments_comparison_arrays,
+)
+from mortgage_calculator.utils import get_amortization_balance, get_monthly_pmi_array
+
+
+def stack_inputs(inputs_list) -> SimpleNamespace:
+    """
+    Turn a collection of Inputs into a namespace with one float array of shape (n_scenarios, 1)
+    per Inputs field, so it can be used anywhere an Inputs is read by attribute.
+    """
+    inputs_list = list(inputs_list)
+    return SimpleNamespace(**{
+        field.name: np.array([getattr(inputs, field.name) for inputs in inputs_list], dtype=float)[:, None]
+        for field in fields(Inputs)
+    })
+
+
+def get_batch_monthly_sim(inputs_list, extra_payments: bool = False, n_months: int = None) -> dict:
+    """
+    Vectorized get_monthly_sim_loop over many scenarios. Returns a dict with one array of shape
+    (n_scenarios, n_months) per monthly column. Column j of every array is month j of the
+    simulation. n_months defaults to the longest horizon of the scenarios, months past the
+    horizon of a scenario are simulated as if it was held longer. A smaller n_months stops the
+    simulation early, e.g. when only the first years are needed.
+    """
+
+    p = stack_inputs(inputs_list)
+    n = p.home_price.shape[0]
+    if n_months is None:
+        n_months = 12 * int(p.horizon_years.max())
+
+    # Flatten the (n, 1) inputs for the monthly loop, which works on (n,) state vectors
+    p = SimpleNamespace(**{name: value[:, 0] for name, value in vars(p).items()})
+
+    sim = {col: np.empty((n, n_months)) for col in MONTHLY_COLUMNS}
+
+    ########################################################################
+    #      initialize, updated yearly                                      #
+    ########################################################################
+
+    pmi_exp = get_monthly_pmi_array(p.home_price, p.loan_amount, p.pmi_rate, p.home_price)
+    property_tax_exp = p.home_price * p.yr_property_tax_rate / 12
+    insurance_exp = p.home_price * p.yr_insurance_rate / 12
+    maintenance_exp = p.home_price * p.yr_maintenance / 12
+    hoa_exp = p.mo_hoa_fees.copy()
+    utility_exp = p.mo_utility.copy()
+    rent_comparison_exp = p.mo_rent_comparison_exp.copy()
+
+    ########################################################################
+    #      initialize, updated monthly                                     #
+    ########################################################################
+
+    loan_balance = p.loan_amount.copy()
+    home_value = p.home_price.copy()
+    pmi_required = pmi_exp > 0
+
+    rent_comparison_portfolio = p.cash_outlay.copy()
+    extra_payments_portfolio = np.zeros(n)
+
+    # Growth factors are constant per scenario, compute them once
+    home_growth = (1 + p.yr_home_appreciation) ** (1 / 12)
+    rent_portfolio_growth = (1 + p.rent_surplus_portfolio_growth) ** (1 / 12)
+    extra_portfolio_growth = (1 + p.extra_payments_portfolio_growth) ** (1 / 12)
+    inflation_growth = 1 + p.yr_inflation_rate
+    rent_growth = 1 + p.yr_rent_increase
+    term_months = 12 * p.loan_term_years
+
+    for month in range(n_months):
+
+        interest_exp = loan_balance * p.interest_rate / 12
+        principal_exp = p.mo_amortized - interest_exp
+        extra_payment_exp = np.zeros(n)
+
+        if extra_payments:
+            payoff = principal_exp >= loan_balance
+            principal_exp = np.where(payoff, loan_balance, principal_exp)
+            extra_allowed = ~payoff & (month < p.num_extra_payments)
+            extra_payment_exp = np.where(
+                extra_allowed,
+                np.minimum(loan_balance - principal_exp, p.mo_extra_payment),
+                0.0
+            )
+
+        # No more payments once the loan term is over
+        after_term = month >= term_months
+        if after_term.any():
+            interest_exp = np.where(after_term, 0.0, interest_exp)
+            principal_exp = np.where(after_term, 0.0, principal_exp)
+            extra_payment_exp = np.where(after_term, 0.0, extra_payment_exp)
+            loan_balance = np.where(after_term, 0.0, loan_balance)
+
+        loan_balance = loan_balance - principal_exp - extra_payment_exp
+
+        pmi_exp = np.where(pmi_required, pmi_exp, 0.0)
+        pmi_true = get_monthly_pmi_array(home_value, loan_balance, p.pmi_rate, p.home_price)
+        pmi_required = pmi_true > 0
+
+        ownership_exp = (
+            property_tax_exp +
+            insurance_exp +
+            hoa_exp +
+            maintenance_exp +
+            pmi_exp +
+            utility_exp +
+            interest_exp
+        )
+
+        total_exp = ownership_exp + principal_exp + extra_payment_exp
+
+        rent_comparison_portfolio = rent_comparison_portfolio + np.maximum(0, total_exp - rent_comparison_exp)
+        extra_payments_portfolio = extra_payments_portfolio + extra_payment_exp
+
+        home_value = home_value * home_growth
+        rent_comparison_portfolio = rent_comparison_portfolio * rent_portfolio_growth
+        extra_payments_portfolio = extra_payments_portfolio * extra_portfolio_growth
+
+        sim["interest_exp"][:, month] = interest_exp
+        sim["principal_exp"][:, month] = principal_exp
+        sim["property_tax_exp"][:, month] = property_tax_exp
+        sim["insurance_exp"][:, month] = insurance_exp
+        sim["hoa_exp"][:, month] = hoa_exp
+        sim["maintenance_exp"][:, month] = maintenance_exp
+        sim["pmi_exp"][:, month] = pmi_exp
+        sim["utility_exp"][:, month] = utility_exp
+        sim["total_exp"][:, month] = total_exp
+        sim["ownership_exp"][:, month] = ownership_exp
+        sim["loan_balance"][:, month] = loan_balance
+        sim["home_value"][:, month] = home_value
+        sim["rent_comparison_exp"][:, month] = rent_comparison_exp
+        sim["rent_comparison_portfolio"][:, month] = rent_comparison_portfolio
+        sim["extra_payments_exp"][:, month] = extra_payment_exp
+        sim["extra_payments_portfolio"][:, month] = extra_payments_portfolio
+
+        ########################################################################
+        #      Growth End of Year - Applies to next month values               #
+        ########################################################################
+
+        if (month + 1) % 12 == 0:
+            property_tax_exp = home_value * p.yr_property_tax_rate / 12
+            insurance_exp = home_value * p.yr_insurance_rate / 12
+            hoa_exp = hoa_exp * inflation_growth
+            utility_exp = utility_exp * inflation_growth
+            maintenance_exp = home_value * p.yr_maintenance / 12
+            pmi_exp = pmi_true
+            rent_comparison_exp = rent_comparison_exp * rent_growth
+
+    return sim
+
+
+def get_batch_simulation_arrays(inputs_list, keep_monthly: bool = False) -> dict:
+    """
+    Array form of get_all_simulation_data for many scenarios. Returns a dict with
+    - yearly: dict of (n_scenarios, n_years) yearly columns, n_years being the longest horizon.
+      Years past the horizon of a scenario are NaN.
+    - extra_payments_comparison: dict of (n_scenarios, n_years) comparison columns, NaN for
+      scenarios without extra payments
+    - has_extra_payments: (n_scenarios,) bool mask of scenarios with extra payments configured
+    - horizon_years: (n_scenarios,) number of years simulated for each scenario
+    - monthly: only with keep_monthly, dict of (n_scenarios, n_months) monthly columns with NaN
+      past the horizon
+    """
+
+    inputs_list = list(inputs_list)
+    stacked = stack_inputs(inputs_list)
+
+    monthly = get_batch_monthly_sim(inputs_list, extra_payments=True)
+    n_months = monthly["loan_balance"].shape[1]
+    yearly = get_yearly_agg_arrays(stacked, monthly)
+
+    has_extra_payments = np.array(
+        [bool(inputs.mo_extra_payment and inputs.num_extra_payments) for inputs in inputs_list],
+        dtype=bool
+    )
+
+    # The loan without extra payments only contributes its interest, which has a closed form
+    start_balance = np.concatenate([
+        stacked.loan_amount,
+        get_amortization_balance(stacked.loan_amount, stacked.interest_rate, stacked.mo_amortized, np.arange(1, n_months))
+    ], axis=1)
+    after_term = np.arange(n_months) >= 12 * stacked.loan_term_years
+    interest_no_extra = np.where(after_term, 0.0, start_balance * stacked.interest_rate / 12)
+    yearly_no_extra = {"interest_exp_sum": interest_no_extra.reshape(len(inputs_list), -1, 12).sum(axis=-1)}
+
+    comparison = {
+        col: np.where(has_extra_payments[:, None], values, np.nan)
+        for col, values in get_extra_payments_comparison_arrays(yearly, yearly_no_extra).items()
+    }
+
+    # Nothing after the home is sold counts
+    after_horizon = np.arange(n_months // 12) >= stacked.horizon_years
+    if after_horizon.any():
+        yearly = {col: np.where(after_horizon, np.nan, values) for col, values in yearly.items()}
+        comparison = {col: np.where(after_horizon, np.nan, values) for col, values in comparison.items()}
+
+    arrays = {
+        "yearly": yearly,
+        "extra_payments_comparison": comparison,
+        "has_extra_payments": has_extra_payments,
+        "horizon_years": stacked.horizon_years[:, 0].astype(int),
+    }
+    if keep_monthly:
+        after_horizon = np.arange(n_months) >= 12 * stacked.horizon_years
+        arrays["monthly"] = {col: np.where(after_horizon, np.nan, values) for col, values in monthly.items()}
+    return arrays
+
+
+def get_batch_mortgage_metrics(yearly: dict) -> dict:
+    """Array version of get_mortgage_metrics, one value per scenario. Years past the horizon are skipped."""
+    return {
+        "Total PMI Paid": np.nansum(yearly["pmi_exp_sum"], axis=-1),
+        "Total Taxes Paid": np.nansum(yearly["property_tax_exp_sum"], axis=-1),
+        "Total Interest Paid": np.nansum(yearly["interest_exp_sum"], axis=-1),
+    }
+
+
+def get_final_year_values(values: np.ndarray, horizon_years: np.ndarray) -> np.ndarray:
+    """Value of a (n_scenarios, n_years) yearly column in the last year of every scenario"""
+    return np.take_along_axis(values, horizon_years[:, None] - 1, axis=1)[:, 0]
+
+
+def _to_stacked_frame(columns: dict, rows: np.ndarray, horizon_years: np.ndarray):
+    import pandas as pd
+
+    n_years = horizon_years[rows]
+    index = pd.MultiIndex.from_arrays(
+        [np.repeat(rows, n_years), np.concatenate([np.arange(years) for years in n_years]).astype(int)],
+        names=["scenario", "year"]
+    )
+    return pd.DataFrame(
+        {col: np.concatenate([values[row, :years] for row, years in zip(rows, n_years)]) for col, values in columns.items()},
+        index=index
+    )
+
+
+def get_batch_simulation_data(inputs_list, stacked: bool = False):
+    """
+    Batched get_all_simulation_data.
+
+    By default returns a list with one results dict per scenario, in the same format as
+    get_all_simulation_data. With stacked=True returns a single dict where yearly_df and
+    extra_payments_comparison are (scenario, year) MultiIndex frames and mortgage_metrics is a
+    frame indexed by scenario. Scenarios without extra payments are left out of the stacked
+    comparison frame, like they are left out of the per scenario results.
+    """
+
+    inputs_list = list(inputs_list)
+    arrays = get_batch_simulation_arrays(inputs_list)
+    yearly = arrays["yearly"]
+    comparison = arrays["extra_payments_comparison"]
+    has_extra_payments = arrays["has_extra_payments"]
+    horizon_years = arrays["horizon_years"]
+    metrics = get_batch_mortgage_metrics(yearly)
+
+    if stacked:
+        import pandas as pd
+
+        scenarios = np.arange(len(inputs_list))
+        return {
+            "yearly_df": _to_stacked_frame(yearly, scenarios, horizon_years),
+            "mortgage_metrics": pd.DataFrame(metrics, index=pd.Index(scenarios, name="scenario")),
+            "extra_payments_comparison": _to_stacked_frame(comparison, scenarios[has_extra_payments], horizon_years),
+        }
+
+    all_results = []
+    for i, years in enumerate(horizon_years):
+        results = {
+            "yearly_df": yearly_arrays_to_df({col: values[i, :years] for col, values in yearly.items()}),
+            "mortgage_metrics": {name: values[i] for name, values in metrics.items()},
+        }
+        if has_extra_payments[i]:
+            results["extra_payments_comparison"] = yearly_arrays_to_df({col: values[i, :years] for col, values in comparison.items()})
+        all_results.append(results)
+
+    return all_results
@@ -0,0 +1,437 @@
+"""
+Benchmarks and equivalence checks for the simulation hot paths.
+
+Every benchmark runs a workload over a corpus of randomized Inputs at 1, 1k and 100k
+scenarios and records the wall time, the peak memory allocated by the workload (tracemalloc)
+and the peak RSS of the process. Each benchmark runs in a fresh process so the peak RSS of one
+does not leak into the next. Results are saved as JSON and compared against a stored baseline.
+
+The equivalence harness checks every engine column by column against the reference month loop,
+get_monthly_sim_loop aggregated with the pandas groupby.
+
+python -m mortgage_calculator.benchmark run --output results.json
+python -m mortgage_calculator.benchmark compare baseline.json results.json --threshold 0.1
+python -m mortgage_calculator.benchmark equivalence --n-inputs 200
+python -m mortgage_calculator.benchmark imports
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from mortgage_calculator.calculator import (
+    Inputs,
+    MONTHLY_COLUMNS,
+    get_all_simulation_data,
+    get_monthly_sim,
+    get_monthly_sim_df,
+    get_monthly_sim_loop,
+    get_yearly_agg_arrays,
+    get_yearly_agg_df,
+)
+from mortgage_calculator.batch import get_batch_monthly_sim, get_batch_simulation_arrays, stack_inputs
+from mortgage_calculator.sweep import get_sweep_metrics
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is reported as None there
+    resource = None
+
+
+DEFAULT_SIZES = [1, 1000, 100000]
+
+# Scenarios per call of the batched workloads, so 100k scenarios fit in memory
+BATCH_CHUNK_SIZE = 1000
+
+# Metrics that count as a regression when they grow past the threshold
+COMPARE_METRICS = ["wall_time_s", "alloc_peak_bytes", "peak_rss_bytes"]
+
+
+####################
+# Randomized inputs
+####################
+
+def get_random_inputs(n: int, seed: int = 0) -> list:
+    """
+    n randomized Inputs. Besides typical values, the corpus covers no down payment (PMI),
+    paying the loan off early with large extra payments, falling home prices, no extra
+    payments at all, short loan terms, horizons past the end of the loan, and both the flat and
+    the bracketed tax model for either filing status.
+    """
+
+    rng = np.random.default_rng(seed)
+    home_price = rng.uniform(100000, 1000000, n).round(-3)
+    down_payment = home_price * rng.choice([0.0, 0.03, 0.1, 0.2, 0.5], n)
+
+    columns = {
+        "home_price": home_price,
+        "down_payment": down_payment,
+        "interest_rate": rng.uniform(0.02, 0.09, n),
+        "loan_term_years": rng.choice([10, 15, 20, 30], n),
+        "horizon_years": rng.choice([1, 7, 15, 30, 40], n),
+        "pmi_rate": rng.choice([0.0, 0.005, 0.01], n),
+        "mo_hoa_fees": rng.choice([0, 150, 400], n),
+        "yr_home_appreciation": rng.uniform(-0.03, 0.08, n),
+        "yr_inflation_rate": rng.uniform(0.0, 0.05, n),
+        "yr_rent_increase": rng.uniform(0.0, 0.06, n),
+        "mo_rent_comparison_exp": rng.uniform(800, 5000, n).round(),
+        "rent_surplus_portfolio_growth": rng.uniform(0.0, 0.1, n),
+        "mo_extra_payment": rng.choice([0, 100, 500, 5000], n),
+        "num_extra_payments": rng.choice([0, 12, 60, 360], n),
+        "extra_payments_portfolio_growth": rng.uniform(0.0, 0.1, n),
+        "use_tax_model": rng.choice([False, True], n),
+        "yr_household_income": rng.choice([40000, 150000, 400000, 900000], n),
+        "married_filing_jointly": rng.choice([False, True], n),
+        "primary_residence": rng.choice([False, True], n),
+        "tax_year": rng.choice([2024, 2025], n),
+    }
+    return [
+        Inputs(**{name: values[i].item() for name, values in columns.items()})
+        for i in range(n)
+    ]
+
+
+####################
+# Equivalence
+####################
+
+def _get_mismatches(engine: str, scenario: int, expected: dict, actual: dict, rtol: float, atol: float) -> list:
+    mismatches = []
+    for col, expected_values in expected.items():
+        expected_values = np.asarray(expected_values, dtype=float)
+        actual_values = np.asarray(actual[col], dtype=float)
+        if not np.allclose(actual_values, expected_values, rtol=rtol, atol=atol, equal_nan=True):
+            mismatches.append({
+                "engine": engine,
+                "scenario": scenario,
+                "column": col,
+                "max_abs_diff": float(np.nanmax(np.abs(actual_values - expected_values))),
+            })
+    return mismatches
+
+
+def check_equivalence(inputs_list, rtol: float = 1e-9, atol: float = 1e-6) -> list:
+    """
+    Compares every simulation engine with the reference loop for each of the inputs, with and
+    without extra payments. Monthly columns are checked against get_monthly_sim_loop and yearly
+    columns against get_yearly_agg_df of its frame.
+
+    Returns one dict per mismatching column with the engine, scenario, column and the largest
+    absolute difference. An empty list means every engine agrees with the reference.
+    """
+
+    inputs_list = list(inputs_list)
+    mismatches = []
+
+    for extra_payments in [False, True]:
+        suffix = " (extra payments)" if extra_payments else ""
+        batch_monthly = get_batch_monthly_sim(inputs_list, extra_payments=extra_payments)
+        batch_yearly = get_yearly_agg_arrays(stack_inputs(inputs_list), batch_monthly)
+
+        for i, inputs in enumerate(inputs_list):
+            reference = get_monthly_sim_loop(inputs, extra_payments)
+            reference_yearly = get_yearly_agg_df(inputs, reference.to_df())
+
+            staged = get_monthly_sim(inputs, extra_payments)
+            mismatches += _get_mismatches("get_monthly_sim" + suffix, i, reference.columns, staged.columns, rtol, atol)
+            mismatches += _get_mismatches(
+                "get_yearly_agg_arrays" + suffix, i, reference_yearly, get_yearly_agg_arrays(inputs, staged.columns), rtol, atol
+            )
+
+            # The batch runs to the longest horizon, compare up to the horizon of this scenario
+            n_months = len(reference)
+            batch_columns = {col: batch_monthly[col][i, :n_months] for col in MONTHLY_COLUMNS}
+            mismatches += _get_mismatches("get_batch_monthly_sim" + suffix, i, reference.columns, batch_columns, rtol, atol)
+            batch_yearly_columns = {col: values[i, :n_months // 12] for col, values in batch_yearly.items()}
+            mismatches += _get_mismatches("batch yearly" + suffix, i, reference_yearly, batch_yearly_columns, rtol, atol)
+
+    return mismatches
+
+
+####################
+# Benchmarks
+####################
+
+def _setup_monthly_sim_df(inputs_list):
+    return lambda: [get_monthly_sim_df(inputs, True) for inputs in inputs_list]
+
+
+def _setup_yearly_agg_df(inputs_list):
+    sims = [get_monthly_sim(inputs, True) for inputs in inputs_list]
+    return lambda: [get_yearly_agg_df(inputs, sim) for inputs, sim in zip(inputs_list, sims)]
+
+
+def _setup_all_simulation_data(inputs_list):
+    return lambda: [get_all_simulation_data(inputs) for inputs in inputs_list]
+
+
+def _iter_chunks(items: list):
+    for start in range(0, len(items), BATCH_CHUNK_SIZE):
+        yield items[start:start + BATCH_CHUNK_SIZE]
+
+
+def _setup_batch(inputs_list):
+    return lambda: [get_batch_simulation_arrays(chunk) for chunk in _iter_chunks(inputs_list)]
+
+
+def _setup_sweep(inputs_list):
+    # The points differ in the fields a typical sweep varies, on top of the default inputs
+    swept = ["down_payment", "interest_rate", "mo_extra_payment", "num_extra_payments"]
+    points = [{name: getattr(inputs, name) for name in swept} for inputs in inputs_list]
+    base = Inputs()
+    return lambda: [get_sweep_metrics(base, chunk) for chunk in _iter_chunks(points)]
+
+
+# name: (setup returning the workload for a list of inputs, scenario counts it runs at)
+BENCHMARKS = {
+    "get_monthly_sim_df": (_setup_monthly_sim_df, [1, 1000]),
+    "get_yearly_agg_df": (_setup_yearly_agg_df, [1, 1000]),
+    "get_all_simulation_data": (_setup_all_simulation_data, [1, 1000]),
+    "batch": (_setup_batch, DEFAULT_SIZES),
+    "sweep": (_setup_sweep, DEFAULT_SIZES),
+}
+
+
+def get_peak_rss_bytes():
+    """Peak resident set size of this process, or None where it can not be measured"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def run_benchmark(name: str, n_scenarios: int, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Runs one benchmark in this process. wall_time_s is the fastest of repeat runs, the
+    allocations are measured on a separate run since tracing slows the workload down.
+    """
+
+    setup, _ = BENCHMARKS[name]
+    workload = setup(get_random_inputs(n_scenarios, seed))
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        workload()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        workload()
+        _, alloc_peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "name": name,
+        "n_scenarios": n_scenarios,
+        "repeat": repeat,
+        "wall_time_s": min(times),
+        "wall_time_median_s": float(np.median(times)),
+        "alloc_peak_bytes": alloc_peak_bytes,
+        "peak_rss_bytes": get_peak_rss_bytes(),
+    }
+
+
+def run_benchmarks(names=None, max_scenarios: int = None, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Runs the benchmarks, each in a fresh process, and returns the results with metadata about
+    the environment. names defaults to every benchmark, max_scenarios skips the larger sizes.
+    """
+
+    names = list(BENCHMARKS) if names is None else names
+    cases = [
+        (name, n)
+        for name in names
+        for n in BENCHMARKS[name][1]
+        if max_scenarios is None or n <= max_scenarios
+    ]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name, n in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(run_benchmark, name, n, repeat, seed).result())
+
+    return {
+        "metadata": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    """
+    Benchmarks in both result sets whose wall time, allocations or peak RSS grew by more than
+    threshold, e.g. 0.1 for 10%. Returns one dict per regressed metric.
+    """
+
+    baseline_results = {(r["name"], r["n_scenarios"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["name"], result["n_scenarios"])
+        if key not in baseline_results:
+            continue
+        for metric in COMPARE_METRICS:
+            before, after = baseline_results[key].get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            ratio = after / before
+            if ratio > 1 + threshold:
+                regressions.append({
+                    "name": result["name"],
+                    "n_scenarios": result["n_scenarios"],
+                    "metric": metric,
+                    "baseline": before,
+                    "current": after,
+                    "ratio": ratio,
+                })
+    return regressions
+
+
+####################
+# Import time
+####################
+
+# Cold start budgets in seconds, for importing and making a one off call in a fresh
+# interpreter. NumPy takes most of it, pandas alone would take more than the whole budget.
+IMPORT_BUDGETS = {
+    "payment": (
+        "from mortgage_calculator.utils import get_amortization_payment; get_amortization_payment(250000, 0.065)",
+        0.4,
+    ),
+    "summary": (
+        "from mortgage_calculator.core import Inputs, get_simulation_summary; get_simulation_summary(Inputs())",
+        0.5,
+    ),
+    "calculator": ("import mortgage_calculator.calculator", 0.5),
+    "service": ("import mortgage_calculator.service", 0.6),
+}
+
+# Only imported once a frame or plot is requested, never by the cold start cases
+LAZY_MODULES = ["pandas", "matplotlib"]
+
+_COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "lazy_modules": [name for name in {lazy_modules!r} if name in sys.modules]}}))
+"""
+
+
+def measure_cold_start(statement: str, repeat: int = 3) -> dict:
+    """Fastest of repeat runs of statement, each in a fresh interpreter, and the lazy modules it imported"""
+    script = _COLD_START_SCRIPT.format(statement=statement, lazy_modules=LAZY_MODULES)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")]))}
+
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True, env=env)
+        runs.append(json.loads(output.stdout))
+    return {
+        "seconds": min(run["seconds"] for run in runs),
+        "lazy_modules": sorted(set(sum((run["lazy_modules"] for run in runs), []))),
+    }
+
+
+def check_import_budgets(repeat: int = 3) -> list:
+    """Measures every IMPORT_BUDGETS case, ok is False when it is over budget or imported a lazy module"""
+    results = []
+    for name, (statement, budget) in IMPORT_BUDGETS.items():
+        measured = measure_cold_start(statement, repeat)
+        results.append({
+            "name": name,
+            "budget_s": budget,
+            **measured,
+            "ok": measured["seconds"] <= budget and not measured["lazy_modules"],
+        })
+    return results
+
+
+####################
+# Command line
+####################
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the mortgage simulation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and save the results as JSON")
+    run_parser.add_argument("--output", "-o", default="benchmark_results.json")
+    run_parser.add_argument("--benchmark", action="append", choices=list(BENCHMARKS), help="Repeatable, defaults to all")
+    run_parser.add_argument("--max-scenarios", type=int, help="Skip sizes with more scenarios")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=0)
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative growth")
+
+    equivalence_parser = commands.add_parser("equivalence", help="Check every engine against the reference loop")
+    equivalence_parser.add_argument("--n-inputs", type=int, default=200)
+    equivalence_parser.add_argument("--seed", type=int, default=0)
+
+    imports_parser = commands.add_parser("imports", help="Check the cold start import time budgets")
+    imports_parser.add_argument("--repeat", type=int, default=3)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run_benchmarks(args.benchmark, args.max_scenarios, args.repeat, args.seed)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        for result in results["results"]:
+            print(f"{result['name']:<25} {result['n_scenarios']:>7} {result['wall_time_s']:>10.4f}s")
+        return 0
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['name']} n={r['n_scenarios']} {r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g} ({r['ratio']:.2f}x)")
+        if not regressions:
+            print("No regressions")
+        return 1 if regressions else 0
+
+    if args.command == "imports":
+        results = check_import_budgets(args.repeat)
+        for r in results:
+            lazy = f" imported {', '.join(r['lazy_modules'])}" if r["lazy_modules"] else ""
+            print(f"{'OK' if r['ok'] else 'OVER BUDGET'} {r['name']:<12} {r['seconds']:.3f}s of {r['budget_s']:.3f}s{lazy}")
+        return 0 if all(r["ok"] for r in results) else 1
+
+    mismatches = check_equivalence(get_random_inputs(args.n_inputs, args.seed))
+    for m in mismatches:
+        print(f"MISMATCH {m['engine']} scenario {m['scenario']} {m['column']}: max abs diff {m['max_abs_diff']:.3g}")
+    if not mismatches:
+        print(f"All engines match the reference loop for {args.n_inputs} inputs")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
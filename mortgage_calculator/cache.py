@@ -0,0 +1,247 @@
+"""
+Result cache for get_all_simulation_data. Results are keyed on a canonical hash of the user
+supplied Inputs fields, so equal inputs always hit the same entry no matter how they were built
+(300000 and 300000.0 are the same home price, and the derived fields are left out).
+
+The in memory tier is an LRU bounded by the memory footprint of the cached frames. An optional
+on disk tier keeps one .npz file per key so warm restarts do not recompute. Files are stamped
+with CACHE_VERSION, files written by another version are misses and get overwritten.
+
+StageCache caches the intermediate stages of the simulation instead, keyed only by the inputs
+each stage depends on, so inputs that share a loan or a home reuse those schedules.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import fields
+
+import numpy as np
+
+from mortgage_calculator.calculator import Inputs, DERIVED_FIELDS, get_all_simulation_data
+
+
+# Bump whenever the results of the same inputs change, e.g. new columns or a fixed formula, so
+# results cached on disk by an older version are recomputed
+CACHE_VERSION = 2
+
+
+def get_canonical_key(values: dict) -> str:
+    """Stable hash of a dict of numeric values, independent of order and int/float type"""
+    canonical = {name: float(value) for name, value in values.items()}
+    payload = json.dumps(canonical, sort_keys=True).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def get_inputs_key(inputs: Inputs) -> str:
+    """Cache key for the user supplied fields of the inputs"""
+    return get_canonical_key({
+        field.name: getattr(inputs, field.name)
+        for field in fields(inputs)
+        if field.name not in DERIVED_FIELDS
+    })
+
+
+def get_results_nbytes(results: dict) -> int:
+    """Approximate memory footprint of a get_all_simulation_data results dict"""
+    import pandas as pd
+
+    nbytes = 0
+    for value in results.values():
+        if isinstance(value, pd.DataFrame):
+            nbytes += int(value.memory_usage(deep=True).sum())
+        else:
+            nbytes += sys.getsizeof(value)
+    return nbytes
+
+
+def _save_results(path: str, results: dict):
+    import pandas as pd
+
+    arrays = {"version": np.array(CACHE_VERSION), "year": results["yearly_df"].index.to_numpy()}
+    for name, value in results.items():
+        if isinstance(value, pd.DataFrame):
+            arrays.update({f"{name}__{col}": value[col].to_numpy() for col in value.columns})
+        else:
+            arrays.update({f"{name}__{metric}": np.asarray(x) for metric, x in value.items()})
+
+    # Write to a temporary file first so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def _load_results(path: str) -> dict:
+    """Results saved at path, or None if they were saved by another CACHE_VERSION"""
+    import pandas as pd
+
+    with np.load(path, allow_pickle=False) as npz:
+        if "version" not in npz.files or int(npz["version"]) != CACHE_VERSION:
+            return None
+        index = pd.Index(npz["year"], name="year")
+        grouped = {}
+        for key in npz.files:
+            if key in ("version", "year"):
+                continue
+            name, col = key.split("__", 1)
+            grouped.setdefault(name, {})[col] = npz[key]
+
+    results = {}
+    for name, columns in grouped.items():
+        if name == "mortgage_metrics":
+            results[name] = {metric: value[()] for metric, value in columns.items()}
+        else:
+            results[name] = pd.DataFrame(columns, index=index)
+    return results
+
+
+class SimulationCache:
+    """
+    Thread safe LRU cache of get_all_simulation_data results.
+
+    max_bytes bounds the memory tier by the DataFrame memory footprint. When cache_dir is set,
+    every computed result is also written there and misses in memory are looked up on disk
+    before recomputing.
+
+    Cached results are shared between callers and should not be modified.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, cache_dir: str = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _put(self, key: str, results: dict):
+        """Add to the memory tier and evict the least recently used entries. Needs the lock."""
+        nbytes = get_results_nbytes(results)
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        self._entries[key] = (results, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+    def get(self, inputs: Inputs):
+        """Cached results for the inputs, or None"""
+        key = get_inputs_key(inputs)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        if self.cache_dir is not None and os.path.exists(self._get_path(key)):
+            results = _load_results(self._get_path(key))
+            if results is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._put(key, results)
+                return results
+
+        return None
+
+    def put(self, inputs: Inputs, results: dict):
+        key = get_inputs_key(inputs)
+        if self.cache_dir is not None:
+            _save_results(self._get_path(key), results)
+        with self._lock:
+            self._put(key, results)
+
+    def get_all_simulation_data(self, inputs: Inputs) -> dict:
+        """get_all_simulation_data, computed only if the inputs are not cached yet"""
+        results = self.get(inputs)
+        if results is not None:
+            return results
+
+        with self._lock:
+            self.misses += 1
+        results = get_all_simulation_data(inputs)
+        self.put(inputs, results)
+        return results
+
+    def clear(self):
+        """Empties the memory tier. Files in cache_dir are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class StageCache:
+    """
+    Thread safe LRU cache of simulation stages, e.g. the loan schedule keyed on the loan terms
+    and the home schedule keyed on the home and expense inputs. Pass it as stage_cache to
+    get_monthly_sim or get_all_simulation_data.
+
+    Every stage has its own LRU bounded by max_entries. Cached arrays are made read only since
+    they are shared by every simulation that reuses them.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._stages = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, stage: str, key: tuple, compute):
+        key = tuple(float(value) for value in key)
+        with self._lock:
+            entries = self._stages.setdefault(stage, OrderedDict())
+            stats = self._stats.setdefault(stage, {"hits": 0, "misses": 0})
+            if key in entries:
+                entries.move_to_end(key)
+                stats["hits"] += 1
+                return entries[key]
+            stats["misses"] += 1
+
+        result = compute()
+        for values in result.values():
+            values.flags.writeable = False
+
+        with self._lock:
+            entries[key] = result
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+            self._stats.clear()
+
+    def stats(self) -> dict:
+        """Hits, misses and entries per stage"""
+        with self._lock:
+            return {
+                stage: {**stats, "entries": len(self._stages[stage])}
+                for stage, stats in self._stats.items()
+            }
@@ -0,0 +1,960 @@
+"""
+Core of the simulation: the inputs, the monthly schedules, the yearly aggregation and the
+summary metrics, computed on NumPy arrays. This module does not import pandas, so workers and
+command line calls that only need a payment figure or the summary metrics start quickly. The
+DataFrame versions of the results are in calculator, which imports pandas when a frame is built.
+
+python -m mortgage_calculator.core --set home_price=400000 --set interest_rate=0.06
+"""
+
+import argparse
+from dataclasses import dataclass, asdict, field, replace
+
+import numpy as np
+
+from mortgage_calculator.utils import (
+    get_amortization_payment,
+    get_amortization_balance,
+    add_growth,
+    get_monthly_pmi,
+    get_monthly_pmi_array,
+)
+from mortgage_calculator.profiling import run_profiled
+from mortgage_calculator.tax import get_tax_table, get_yearly_taxes
+
+
+# e6 = million
+# e5 = hundred thousand
+# e4 = ten thousand
+# e3 = thousand
+
+# int = dollars
+# float = rate
+
+# I dont remember what I was going to do with this
+# paydown_with_profit = False
+
+# Longest loan term and analysis horizon the simulation supports
+MAX_YEARS = 40
+
+# Methodology of extra payments
+# We compare the cumulative interest saved from extra payments versus the extra payments portfolio
+# In otherwords, whats the added net worth from making extra payments?
+# Added networth from extra payments is the interest saved - the extra payments.
+# Added networth from extra payments portfolio is the extra payments portfolio.
+
+# Methodology of rent versus own comparison.
+# What would be your total network worth if you rented instead of buying, assuming all else equal?
+# Networth from renting is the cash outlay plus the money saved from renting added to a portfolio - all rent expenses paid.
+# Networth from buying is adjusted sale income - all expenses paid.
+
+# The field groups only declare fields. Inputs stores them in slots, so the groups have empty
+# __slots__ and can not be instantiated themselves. Every class is frozen, use
+# dataclasses.replace to change a field.
+
+@dataclass(frozen=True)
+class _MortgageFields:
+    __slots__ = ()
+    home_price: int = 300000
+    rehab: int = 1000# Cost of repairs or renovations right after buying
+    down_payment: int = 50000
+    interest_rate: float = 0.065
+    loan_term_years: int = 30 # e.g. 10, 15, 20 or 30 year loans
+    closing_costs_rate: float = 0.03 # Calculated as a percentage of home price
+    pmi_rate: float = 0.005 # Calculated as a percentage of home price
+    
+    closing_costs: float = None
+    cash_outlay: float = None
+    loan_amount: float = None
+    mo_amortized: float = None
+
+    def __post_init__(self):
+        if not 1 <= self.loan_term_years <= MAX_YEARS or self.loan_term_years != int(self.loan_term_years):
+            raise ValueError(f"loan_term_years must be a whole number of years between 1 and {MAX_YEARS}")
+
+        # Frozen, so normalized and derived fields are set through object.__setattr__. Whole
+        # number floats such as 30.0 become ints, the schedules use the term as an array size.
+        object.__setattr__(self, "loan_term_years", int(self.loan_term_years))
+        closing_costs = self.home_price * self.closing_costs_rate
+        loan_amount = self.home_price - self.down_payment
+        object.__setattr__(self, "closing_costs", closing_costs)
+        object.__setattr__(self, "cash_outlay", closing_costs + self.down_payment + self.rehab)
+        object.__setattr__(self, "loan_amount", loan_amount)
+        object.__setattr__(self, "mo_amortized", get_amortization_payment(loan_amount, self.interest_rate, self.loan_term_years))
+
+@dataclass(frozen=True)
+class _ExpensesFields:
+    __slots__ = ()
+    yr_property_tax_rate: float = 0.01
+    yr_insurance_rate: float = 0.0035
+    mo_hoa_fees: int = 0
+    mo_utility: int = 200
+    yr_maintenance: float = 0.015
+
+@dataclass(frozen=True)
+class _EconomicFactorsFields:
+    __slots__ = ()
+    yr_home_appreciation: float = 0.03
+    yr_inflation_rate: float = 0.03
+    yr_rent_increase: float = 0.03
+
+@dataclass(frozen=True)
+class _SellingFields:
+    __slots__ = ()
+    realtor_rate: float = 0.06
+    capital_gains_tax_rate: float = 0.15
+    # Years until the home is sold, the simulation covers this many years
+    horizon_years: int = 30
+
+@dataclass(frozen=True)
+class _TaxFields:
+    __slots__ = ()
+    # Off taxes every gain at the flat capital_gains_tax_rate with no deductions, see tax.py
+    use_tax_model: bool = False
+    yr_household_income: int = 150000 # Taxable income before deductions, grows with inflation
+    married_filing_jointly: bool = True
+    state_income_tax_rate: float = 0.05 # Counts toward the SALT cap with the property taxes
+    primary_residence: bool = True # Home sale gains up to the exclusion are tax free after 2 years
+    tax_year: int = 2025 # Tax table of the first year, later years are indexed to inflation
+
+@dataclass(frozen=True)
+class _RentVsOwnFields:
+    __slots__ = ()
+    # This is the monthly rent you would pay instead of buying the home in consideration
+    mo_rent_comparison_exp: int = 1500
+    # This is the growth rate an alternative investment with an acceptable risk factor. For example, a bond portfolio.
+    rent_surplus_portfolio_growth: float = 0.04
+
+@dataclass(frozen=True)
+class _ExtraPaymentFields:
+    __slots__ = ()
+    mo_extra_payment: int = 300
+    num_extra_payments: int = 12
+    # Compare putting money into your home versus investing in an alternative
+    extra_payments_portfolio_growth: float = 0.04
+
+# Each group on its own, e.g. MortgageInputs() for only the mortgage fields and the fields
+# derived from them. Inputs builds on the field groups, not on these.
+
+@dataclass(frozen=True, slots=True)
+class MortgageInputs(_MortgageFields):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class ExpensesInputs(_ExpensesFields):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class EconomicFactorsInputs(_EconomicFactorsFields):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class SellingInputs(_SellingFields):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class TaxInputs(_TaxFields):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class RentVsOwnInputs(_RentVsOwnFields):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class ExtraPaymentInputs(_ExtraPaymentFields):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class Inputs(
+    _MortgageFields,
+    _ExpensesFields,
+    _EconomicFactorsFields,
+    _SellingFields,
+    _TaxFields,
+    _RentVsOwnFields,
+    _ExtraPaymentFields
+):
+    """
+    All simulation inputs. Instances are immutable, hashable and have no __dict__, which keeps
+    large batches of scenarios small.
+    """
+
+    def __post_init__(self):
+        # Zero argument super() does not work in slotted dataclasses
+        _MortgageFields.__post_init__(self)
+        if not 1 <= self.horizon_years <= MAX_YEARS or self.horizon_years != int(self.horizon_years):
+            raise ValueError(f"horizon_years must be a whole number of years between 1 and {MAX_YEARS}")
+        object.__setattr__(self, "horizon_years", int(self.horizon_years))
+        if self.use_tax_model:
+            get_tax_table(self.tax_year) # Raises a ValueError when there is no table for the year
+
+    def to_dict(self) -> dict:
+        """Returns all data within the inputs as a dictionary."""
+        return asdict(self)
+
+
+# Set in MortgageInputs.__post_init__ from the other inputs
+DERIVED_FIELDS = ["closing_costs", "cash_outlay", "loan_amount", "mo_amortized"]
+
+
+def check_input_field(name: str):
+    """Raises a ValueError unless name is an Inputs field that can be set directly"""
+    if name not in Inputs.__dataclass_fields__:
+        raise ValueError(f"{name} is not an Inputs field")
+    if name in DERIVED_FIELDS:
+        raise ValueError(f"{name} is derived from other inputs and can not be set directly")
+
+N_MONTHS = 12 * 30
+
+
+def get_n_months(inputs) -> int:
+    """Months simulated for the inputs, the analysis horizon"""
+    return 12 * int(inputs.horizon_years)
+
+
+MONTHLY_COLUMNS = [
+    "interest_exp",
+    "principal_exp",
+    "property_tax_exp",
+    "insurance_exp",
+    "hoa_exp",
+    "maintenance_exp",
+    "pmi_exp",
+    "utility_exp",
+    "total_exp",
+    "ownership_exp",
+    "loan_balance",
+    "home_value",
+    "rent_comparison_exp",
+    "rent_comparison_portfolio",
+    "extra_payments_exp",
+    "extra_payments_portfolio",
+]
+
+
+@dataclass
+class MonthlySim:
+    """
+    Columnar result of the monthly simulation. Holds one float64 array per monthly column,
+    row j of every column is month j. The pandas frame is only built when to_df is called.
+    """
+    columns: dict
+    _df: object = field(default=None, init=False, repr=False)
+
+    def __getitem__(self, col: str) -> np.ndarray:
+        return self.columns[col]
+
+    def __len__(self) -> int:
+        return len(self.columns["loan_balance"])
+
+    def to_df(self):
+        """Returns the get_monthly_sim_df frame, built once on first use"""
+        if self._df is None:
+            from mortgage_calculator.calculator import monthly_arrays_to_df
+            self._df = monthly_arrays_to_df(self.columns)
+        return self._df
+
+
+# Inputs each cacheable stage of the simulation depends on
+HOME_SCHEDULE_FIELDS = [
+    "home_price",
+    "yr_home_appreciation",
+    "yr_property_tax_rate",
+    "yr_insurance_rate",
+    "yr_maintenance",
+    "mo_hoa_fees",
+    "mo_utility",
+    "yr_inflation_rate",
+    "horizon_years",
+]
+
+
+def run_stage(stage_cache, stage: str, key: tuple, compute):
+    """
+    Runs compute for a stage of the simulation, or reuses an earlier result from the stage
+    cache (see cache.StageCache) when one is given.
+    """
+    if stage_cache is None:
+        return compute()
+    return stage_cache.get_or_compute(stage, key, compute)
+
+
+def get_monthly_sim(inputs: Inputs, extra_payments: bool = False, stage_cache=None) -> MonthlySim:
+    """
+    Runs the monthly simulation, see get_monthly_sim_loop for the methodology.
+
+    The simulation is built from array stages instead of a month loop: the home value and
+    expense schedule, the loan schedule and finally PMI, totals and portfolios. Both paths
+    agree within floating point tolerance. With a stage_cache the home and loan schedules are
+    reused across inputs that share them.
+    """
+    home = run_profiled("home_schedule", get_inputs_home_schedule, inputs, stage_cache)
+    loan = run_profiled("loan_schedule", get_inputs_loan_schedule, inputs, extra_payments, stage_cache)
+    return run_profiled("assemble_monthly_sim", assemble_monthly_sim, inputs, home, loan)
+
+
+def get_loan_schedule(
+    loan_amount: float,
+    interest_rate: float,
+    mo_amortized: float,
+    mo_extra_payment: float = 0,
+    num_extra_payments: int = 0,
+    clamp_payoff: bool = False,
+    n_months: int = N_MONTHS,
+    term_months: int = N_MONTHS,
+) -> dict:
+    """
+    Interest, principal, extra payments and loan balance for the first n_months of the loan.
+
+    Months with extra payments are stepped through one at a time. Once no more extra payments
+    are made the rest of the schedule is the closed form amortization of the remaining balance.
+    clamp_payoff caps the principal at the remaining balance like the loop does when extra
+    payments are enabled. After the loan is paid off, or after term_months, every loan column
+    is zero and nothing more is computed.
+    """
+
+    interest_exp = np.zeros(n_months)
+    principal_exp = np.zeros(n_months)
+    extra_payments_exp = np.zeros(n_months)
+    loan_balance = np.zeros(n_months)
+
+    monthly_rate = interest_rate / 12
+    balance = loan_amount
+
+    # Months in which payments are made, the rest stay zero
+    n_payments = min(n_months, term_months)
+
+    n_stepped = 0
+    if clamp_payoff:
+        n_stepped = min(int(num_extra_payments), n_payments) if mo_extra_payment else 0
+        if mo_amortized < 0:
+            # Negative loans never settle into the closed form
+            n_stepped = n_payments
+
+    start = 0
+    while start < n_stepped:
+        interest = balance * monthly_rate
+        principal = mo_amortized - interest
+        extra = 0
+        paid_off = principal >= balance
+        if paid_off:
+            principal = balance
+        elif start < num_extra_payments:
+            extra = min(balance - principal, mo_extra_payment)
+        balance -= principal
+        balance -= extra
+
+        interest_exp[start] = interest
+        principal_exp[start] = principal
+        extra_payments_exp[start] = extra
+        loan_balance[start] = balance
+        start += 1
+
+        if paid_off and mo_amortized >= 0:
+            # Every later month is zero
+            return {
+                "interest_exp": interest_exp,
+                "principal_exp": principal_exp,
+                "extra_payments_exp": extra_payments_exp,
+                "loan_balance": loan_balance,
+            }
+
+    if start < n_payments:
+        rest_balance = get_amortization_balance(balance, interest_rate, mo_amortized, np.arange(1, n_payments - start + 1))
+        rest_start_balance = np.concatenate([[balance], rest_balance[:-1]])
+        rest_interest = rest_start_balance * monthly_rate
+        rest_principal = mo_amortized - rest_interest
+
+        if clamp_payoff:
+            payoff = np.flatnonzero(rest_principal >= rest_start_balance)
+            if payoff.size:
+                month = payoff[0]
+                rest_principal[month] = rest_start_balance[month]
+                rest_balance[month] = 0
+                rest_interest[month + 1:] = 0
+                rest_principal[month + 1:] = 0
+                rest_balance[month + 1:] = 0
+
+        interest_exp[start:n_payments] = rest_interest
+        principal_exp[start:n_payments] = rest_principal
+        loan_balance[start:n_payments] = rest_balance
+
+    return {
+        "interest_exp": interest_exp,
+        "principal_exp": principal_exp,
+        "extra_payments_exp": extra_payments_exp,
+        "loan_balance": loan_balance,
+    }
+
+
+def get_inputs_loan_schedule(inputs: Inputs, extra_payments: bool = False, stage_cache=None) -> dict:
+    """get_loan_schedule for the loan described by the inputs, up to the horizon"""
+    n_months = get_n_months(inputs)
+    term_months = 12 * int(inputs.loan_term_years)
+    if extra_payments:
+        args = (
+            inputs.loan_amount,
+            inputs.interest_rate,
+            inputs.mo_amortized,
+            inputs.mo_extra_payment,
+            inputs.num_extra_payments,
+            True,
+            n_months,
+            term_months,
+        )
+    else:
+        args = (inputs.loan_amount, inputs.interest_rate, inputs.mo_amortized, 0, 0, False, n_months, term_months)
+    return run_stage(stage_cache, "loan", args, lambda: get_loan_schedule(*args))
+
+
+def get_inputs_home_schedule(inputs: Inputs, stage_cache=None) -> dict:
+    """get_home_schedule, keyed on HOME_SCHEDULE_FIELDS when cached"""
+    key = tuple(getattr(inputs, name) for name in HOME_SCHEDULE_FIELDS)
+    return run_stage(stage_cache, "home", key, lambda: get_home_schedule(inputs))
+
+
+def get_yearly_steps(value: float, yearly_growth_rate: float, n_years: int = N_MONTHS // 12) -> np.ndarray:
+    """Monthly values of an amount that grows once a year, at the end of every year"""
+    growth = add_growth(1, yearly_growth_rate, months=12)
+    return np.repeat(np.cumprod(np.concatenate([[value], np.full(n_years - 1, growth)])), 12)
+
+
+def get_home_schedule(inputs: Inputs) -> dict:
+    """
+    Home value and the ownership expense streams that do not depend on the loan. Home value
+    grows geometrically and taxes, insurance and maintenance are step functions of the home
+    value at the start of each year. HOA and utility grow with inflation once a year.
+    start_home_value is the value before the growth of each month, which is what PMI is based on.
+    """
+
+    # Value at the start of each month, built with a cumulative product like the loop
+    home_growth = add_growth(1, inputs.yr_home_appreciation, months=1)
+    start_home_value = np.cumprod(np.concatenate([[inputs.home_price], np.full(get_n_months(inputs), home_growth)]))
+
+    # Expenses are reset from the home value at the end of every year
+    year_home_value = start_home_value[:-1:12]
+
+    return {
+        "start_home_value": start_home_value[:-1],
+        "home_value": start_home_value[1:],
+        "property_tax_exp": np.repeat(year_home_value * inputs.yr_property_tax_rate / 12, 12),
+        "insurance_exp": np.repeat(year_home_value * inputs.yr_insurance_rate / 12, 12),
+        "maintenance_exp": np.repeat(year_home_value * inputs.yr_maintenance / 12, 12),
+        "hoa_exp": get_yearly_steps(inputs.mo_hoa_fees, inputs.yr_inflation_rate, inputs.horizon_years),
+        "utility_exp": get_yearly_steps(inputs.mo_utility, inputs.yr_inflation_rate, inputs.horizon_years),
+    }
+
+
+def get_pmi_schedule(inputs: Inputs, start_home_value: np.ndarray, loan_balance: np.ndarray, initial_pmi=None) -> np.ndarray:
+    """
+    PMI paid each month. The rate paid during a year is the PMI recalculated at the end of the
+    previous year, and PMI stops for the rest of the year once a month no longer requires it.
+    Home value and loan balance can carry leading dimensions, e.g. (n_paths, n_months).
+
+    initial_pmi is the PMI recalculated just before the first month, by default the PMI at
+    closing. Pass it to compute the schedule from the start of a later year.
+    """
+
+    start_home_value, loan_balance = np.broadcast_arrays(start_home_value, loan_balance)
+    shape = loan_balance.shape
+    n_years = shape[-1] // 12
+
+    if initial_pmi is None:
+        initial_pmi = get_monthly_pmi(inputs.home_price, inputs.loan_amount, inputs.pmi_rate, inputs.home_price)
+    pmi_true = get_monthly_pmi_array(start_home_value, loan_balance, inputs.pmi_rate, inputs.home_price)
+
+    first_month = shape[:-1] + (1,)
+    year_pmi = np.concatenate([np.full(first_month, initial_pmi), pmi_true[..., 11:-1:12]], axis=-1)
+    required = np.concatenate([np.full(first_month, initial_pmi > 0), pmi_true[..., :-1] > 0], axis=-1)
+    cancelled = np.cumsum(~required.reshape(shape[:-1] + (n_years, 12)), axis=-1).reshape(shape) > 0
+    return np.where(cancelled, 0.0, np.repeat(year_pmi, 12, axis=-1))
+
+
+def get_portfolio_values(initial_value, contributions: np.ndarray, yearly_growth_rate) -> np.ndarray:
+    """
+    Value at the end of each month of a portfolio that receives a contribution and then grows
+    every month. p[m] = (p[m-1] + c[m]) * g  =>  p[m] = g^(m+1) * (p0 + sum(c[k] / g^k))
+    The growth rate can be a single rate or an array of monthly rates, and both can carry
+    leading dimensions, e.g. (n_paths, n_months).
+    """
+    monthly_growth = add_growth(1, np.asarray(yearly_growth_rate, dtype=float), months=1)
+    shape = np.broadcast_shapes(np.shape(contributions), np.shape(monthly_growth))
+    growth = np.cumprod(np.broadcast_to(monthly_growth, shape), axis=-1)
+    start_growth = np.concatenate([np.ones(growth.shape[:-1] + (1,)), growth[..., :-1]], axis=-1)
+    return growth * (initial_value + np.cumsum(contributions / start_growth, axis=-1))
+
+
+# Monthly expenses summed into ownership_exp, everything owning costs except paying down the loan
+OWNERSHIP_EXP_COLUMNS = [
+    "property_tax_exp",
+    "insurance_exp",
+    "hoa_exp",
+    "maintenance_exp",
+    "pmi_exp",
+    "utility_exp",
+    "interest_exp",
+]
+
+
+def get_ownership_columns(monthly: dict, one_time_exp=0) -> dict:
+    """
+    ownership_exp and total_exp from the expense columns of monthly. Works on arrays of any
+    shape, e.g. (n_months,) or (n_paths, n_months). one_time_exp, such as refinance closing
+    costs, is added to ownership_exp.
+    """
+    ownership_exp = monthly[OWNERSHIP_EXP_COLUMNS[0]]
+    for col in OWNERSHIP_EXP_COLUMNS[1:]:
+        ownership_exp = ownership_exp + monthly[col]
+    ownership_exp = ownership_exp + one_time_exp
+    return {
+        "ownership_exp": ownership_exp,
+        "total_exp": ownership_exp + monthly["principal_exp"] + monthly["extra_payments_exp"],
+    }
+
+
+def get_portfolio_columns(
+    inputs: Inputs,
+    monthly: dict,
+    initial_values=None,
+    growth_rates=None,
+    columns=("rent_comparison_portfolio", "extra_payments_portfolio"),
+) -> dict:
+    """
+    The comparison portfolios from the monthly totals. The rent comparison portfolio starts
+    at the cash outlay and receives whatever owning costs more than renting each month, the
+    extra payments portfolio receives the extra payments. initial_values and growth_rates
+    override the defaults per portfolio, e.g. to continue from a checkpoint or to follow
+    sampled growth paths.
+    """
+    initial_values = {
+        "rent_comparison_portfolio": inputs.cash_outlay,
+        "extra_payments_portfolio": 0,
+        **(initial_values or {}),
+    }
+    growth_rates = {
+        "rent_comparison_portfolio": inputs.rent_surplus_portfolio_growth,
+        "extra_payments_portfolio": inputs.extra_payments_portfolio_growth,
+        **(growth_rates or {}),
+    }
+
+    portfolios = {}
+    if "rent_comparison_portfolio" in columns:
+        portfolios["rent_comparison_portfolio"] = get_portfolio_values(
+            initial_values["rent_comparison_portfolio"],
+            np.maximum(0, monthly["total_exp"] - monthly["rent_comparison_exp"]),
+            growth_rates["rent_comparison_portfolio"]
+        )
+    if "extra_payments_portfolio" in columns:
+        portfolios["extra_payments_portfolio"] = get_portfolio_values(
+            initial_values["extra_payments_portfolio"],
+            monthly["extra_payments_exp"],
+            growth_rates["extra_payments_portfolio"]
+        )
+    return portfolios
+
+
+def assemble_monthly_sim(inputs: Inputs, home: dict, loan: dict) -> MonthlySim:
+    """
+    Combine a home schedule and a loan schedule into the full monthly simulation. PMI, the
+    totals and the comparison portfolios depend on almost every input, so they are always
+    computed here rather than cached.
+    """
+
+    monthly = {
+        **home,
+        **loan,
+        "pmi_exp": get_pmi_schedule(inputs, home["start_home_value"], loan["loan_balance"]),
+        "rent_comparison_exp": get_yearly_steps(inputs.mo_rent_comparison_exp, inputs.yr_rent_increase, inputs.horizon_years),
+    }
+    monthly.update(get_ownership_columns(monthly))
+    monthly.update(get_portfolio_columns(inputs, monthly))
+    return MonthlySim({col: monthly[col] for col in MONTHLY_COLUMNS})
+
+
+def get_monthly_sim_loop(inputs: Inputs, extra_payments: bool = False) -> MonthlySim:
+    """
+    Simulation iterates over months. Each row corresponds to the total costs paid for a particular
+    expenses over the month, or the value of an asset at the end of the month. Row 0 corresponds to
+    the end of the first month since closing.
+    The simulation runs until the home is sold after horizon_years, and no loan payments are
+    made after the loan term.
+
+    Extra payments will apply extra payments to the principle of the loan and also add the extra payment
+    to the extra payments portfolio.
+
+    PMI is a little tricky to follow because it can be cancelled anytime based on the price of PMI 
+    returned by the function but the price paid is updated once a year.
+    pmi_true:     holds the value of PMI if it was recalculated
+    pmi_exp:      holds the actual PMI paid and is updated yearly
+    pmi_required: is not required if the true_pmi <= 0 and will cancel the pmi_exp
+
+    The simulation will track additional portfolios in parallel for comparison whose value 
+    do not effect the mortgage and expenses itself.
+
+    Each month is written in place into one preallocated (columns x months) float64 array.
+    """
+
+    ########################################################################
+    #      initialize, updated yearly                                      #
+    ########################################################################
+    
+    pmi_exp = get_monthly_pmi(
+        inputs.home_price, 
+        inputs.loan_amount, 
+        inputs.pmi_rate, 
+        inputs.home_price
+    )
+    property_tax_exp = inputs.home_price * inputs.yr_property_tax_rate / 12
+    insurance_exp = inputs.home_price * inputs.yr_insurance_rate / 12
+    maintenance_exp = inputs.home_price * inputs.yr_maintenance / 12
+    hoa_exp = inputs.mo_hoa_fees
+    utility_exp = inputs.mo_utility
+    rent_comparison_exp = inputs.mo_rent_comparison_exp
+
+    ########################################################################
+    #      initialize, updated monthly                                     #
+    ########################################################################
+    
+    loan_balance = inputs.loan_amount
+    home_value = inputs.home_price
+    pmi_required = pmi_exp > 0
+
+    # Stock portfolio comparisons
+    rent_comparison_portfolio = inputs.cash_outlay # portfolio funded with money saved from renting
+    extra_payments_portfolio = 0 # portfolio funded with extra payments
+
+
+    n_months = get_n_months(inputs)
+    term_months = 12 * inputs.loan_term_years
+
+    values = np.empty((len(MONTHLY_COLUMNS), n_months))
+    for month in range(n_months):
+
+        ########################################################################
+        #      Principle and Interest                                          #
+        ########################################################################
+
+        interest_exp = loan_balance * inputs.interest_rate / 12
+        principal_exp = inputs.mo_amortized - interest_exp
+        extra_payment_exp = 0
+
+        # extra payments are the only time we might need to adjust principle exp
+        if extra_payments:
+            if principal_exp >= loan_balance:
+                principal_exp = loan_balance
+            elif month < inputs.num_extra_payments:
+                extra_payment_exp = min(loan_balance - principal_exp, inputs.mo_extra_payment)
+
+        # No more payments once the loan term is over
+        if month >= term_months:
+            interest_exp = principal_exp = extra_payment_exp = 0
+            loan_balance = 0
+
+        loan_balance -= principal_exp
+        loan_balance -= extra_payment_exp
+
+        ########################################################################
+        #      PMI                                                             #
+        ########################################################################
+
+        # pay pmi if required
+        if not pmi_required:
+            pmi_exp = 0
+
+        # update pmi_required, but dont update pmi cost unless its end of year
+        pmi_true = get_monthly_pmi(home_value, loan_balance, inputs.pmi_rate, inputs.home_price)
+        pmi_required = pmi_true > 0
+
+        ########################################################################
+        #      Growth During Month                                             #
+        ########################################################################
+        
+        # Sum of all the expenses for the month
+        ownership_exp = (
+            property_tax_exp +
+            insurance_exp +
+            hoa_exp +
+            maintenance_exp +
+            pmi_exp +
+            utility_exp +
+            interest_exp
+        )
+        
+        total_exp = ownership_exp + principal_exp + extra_payment_exp
+
+        # contribute to portfolio if you saved money from renting
+        rent_comparison_portfolio += max(0, total_exp - rent_comparison_exp)
+
+        # contribute any extra payments to portfolio
+        extra_payments_portfolio += extra_payment_exp
+
+        home_value = add_growth(home_value, inputs.yr_home_appreciation, months=1)
+        rent_comparison_portfolio = add_growth(
+            rent_comparison_portfolio,
+            inputs.rent_surplus_portfolio_growth, 
+            months=1
+        )
+        extra_payments_portfolio = add_growth(
+            extra_payments_portfolio, 
+            inputs.extra_payments_portfolio_growth, 
+            months=1
+        )
+
+        # Same order as MONTHLY_COLUMNS
+        values[:, month] = (
+            # Expenses
+            interest_exp,
+            principal_exp,
+            property_tax_exp,
+            insurance_exp,
+            hoa_exp,
+            maintenance_exp,
+            pmi_exp,
+            utility_exp,
+            total_exp,
+            ownership_exp,
+            # Balances and Values
+            loan_balance,
+            home_value,
+            # Rent Comparison
+            rent_comparison_exp,
+            rent_comparison_portfolio,
+            # Extra Payments
+            extra_payment_exp,
+            extra_payments_portfolio
+        )
+
+        ########################################################################
+        #      Growth End of Year - Applies to next month values               #
+        ########################################################################
+
+        if (month + 1) % 12 == 0 and month > 0:
+            property_tax_exp = home_value * inputs.yr_property_tax_rate / 12
+            insurance_exp = home_value * inputs.yr_insurance_rate / 12
+            hoa_exp = add_growth(hoa_exp, inputs.yr_inflation_rate, 12)
+            utility_exp = add_growth(utility_exp, inputs.yr_inflation_rate, 12)
+            maintenance_exp = home_value * inputs.yr_maintenance / 12
+            pmi_exp = pmi_true
+            rent_comparison_exp = add_growth(rent_comparison_exp, inputs.yr_rent_increase, 12)
+
+    return MonthlySim(dict(zip(MONTHLY_COLUMNS, values)))
+
+
+YEARLY_AGG_DICT = {
+    "interest_exp":     ["mean", "sum"],
+    "principal_exp":    "mean",
+    "property_tax_exp": ["mean", "sum"],
+    "insurance_exp":    "mean",
+    "hoa_exp":          "mean",
+    "maintenance_exp":  "mean",
+    "pmi_exp":          ["mean", "sum"],
+    "utility_exp":      "mean",
+    "total_exp":        ["mean", "sum"],
+    "ownership_exp":    "sum",
+    "rent_comparison_exp":  ["mean", "sum"],
+    "extra_payments_exp":   ["mean", "sum"],
+    "loan_balance":         "min", # min if the end of year for loan balance
+    "home_value":           "max",
+    "rent_comparison_portfolio": "max",
+    "extra_payments_portfolio":  "max"
+}
+
+EXTRA_PAYMENTS_COMPARISON_COLUMNS = [
+    "interest_exp_cumulative",
+    "interest_exp_cumulative_with_extra",
+    "interest_saved",
+    "extra_payments_portfolio_max",
+    "extra_payments_portfolio_gains",
+    "loan_balance_min"
+]
+
+
+def get_yearly_agg_arrays(inputs, monthly: dict) -> dict:
+    """
+    Array version of get_yearly_agg_df. Monthly columns have shape (..., n_months) and are
+    reduced over reshape(..., n_years, 12) blocks instead of a pandas groupby. The inputs can be
+    a single Inputs, or any object whose attributes are arrays that broadcast against the
+    yearly columns, e.g. shape (n_scenarios, 1) for a batch of scenarios.
+
+    Returns a dict of yearly columns named and ordered like the get_yearly_agg_df columns.
+    """
+    return add_yearly_metrics(inputs, get_yearly_column_aggs(monthly))
+
+
+def get_yearly_column_aggs(monthly: dict, columns=None) -> dict:
+    """
+    The YEARLY_AGG_DICT reductions of the monthly columns, or only of the given columns,
+    computed over reshape(..., n_years, 12) blocks.
+    """
+    year = {}
+    for col, funcs in YEARLY_AGG_DICT.items():
+        if columns is not None and col not in columns:
+            continue
+        values = np.asarray(monthly[col], dtype=float)
+        values = values.reshape(values.shape[:-1] + (-1, 12))
+        for func in [funcs] if isinstance(funcs, str) else funcs:
+            year[f"{col}_{func}"] = getattr(values, func)(axis=-1)
+    return year
+
+
+def add_yearly_metrics(inputs, year: dict) -> dict:
+    """Adds the net worth metrics derived from the yearly aggregates to year and returns it"""
+
+    shape = year["home_value_max"].shape
+    taxes = get_yearly_taxes(inputs, year)
+
+    # Calculate the "net worth" from owning
+    year["equity"] = year["home_value_max"] - year["loan_balance_min"]
+    year["realtor_fee"] = year["home_value_max"] * inputs.realtor_rate
+    year["adjusted_cost_basis"] = np.broadcast_to(inputs.home_price + inputs.rehab, shape)
+    year["total_gains"] = year["home_value_max"] - year["adjusted_cost_basis"]
+    year["capital_gains_tax"] = taxes["home_sale_tax"]
+    year["ownership_exp_cumulative"] = np.cumsum(year["ownership_exp_sum"], axis=-1)
+    year["tax_savings"] = np.broadcast_to(taxes["tax_savings"], shape)
+    year["tax_savings_cumulative"] = np.cumsum(year["tax_savings"], axis=-1)
+    year["net_worth_from_owning"] = (
+        year["equity"] - year["realtor_fee"] - year["capital_gains_tax"] - year["ownership_exp_cumulative"] +
+        year["tax_savings_cumulative"]
+    )
+
+    # Calculate the "net worth" from renting
+    year["total_exp_cumulative"] = np.cumsum(year["total_exp_sum"], axis=-1)
+    year["rent_exp_cumulative"] = np.cumsum(year["rent_comparison_exp_sum"], axis=-1)
+    year["additional_investment"] = year["total_exp_cumulative"] - year["rent_exp_cumulative"]
+    year["rent_portfolio_cost_basis"] = year["rent_comparison_portfolio_max"] - inputs.cash_outlay - year["additional_investment"]
+    year["capital_gains_tax"] = taxes["rent_portfolio_tax"]
+    year["net_worth_from_renting"] = year["rent_comparison_portfolio_max"] - year["capital_gains_tax"] - year["rent_exp_cumulative"]
+
+    year["ownership_upside"] = year["net_worth_from_owning"] - year["net_worth_from_renting"]
+
+    return year
+
+
+def get_extra_payments_comparison_arrays(yearly: dict, yearly_no_extra: dict) -> dict:
+    """
+    Compares the loan with and without extra payments. yearly is the output of
+    get_yearly_agg_arrays with extra payments, yearly_no_extra only needs the
+    interest_exp_sum of the loan without them.
+    """
+
+    comparison = {}
+    comparison["interest_exp_cumulative"] = np.cumsum(yearly_no_extra["interest_exp_sum"], axis=-1)
+    comparison["interest_exp_cumulative_with_extra"] = np.cumsum(yearly["interest_exp_sum"], axis=-1)
+    comparison["interest_saved"] = comparison["interest_exp_cumulative"] - comparison["interest_exp_cumulative_with_extra"]
+    comparison["extra_payments_portfolio_max"] = yearly["extra_payments_portfolio_max"]
+    comparison["extra_payments_portfolio_gains"] = yearly["extra_payments_portfolio_max"] - np.cumsum(yearly["extra_payments_exp_sum"], axis=-1)
+    comparison["loan_balance_min"] = yearly["loan_balance_min"]
+    return {col: comparison[col] for col in EXTRA_PAYMENTS_COMPARISON_COLUMNS}
+
+
+def get_mortgage_metrics(yearly_df):
+    """Totals over the whole loan, from the yearly frame or the get_yearly_agg_arrays columns"""
+    return {
+        "Total PMI Paid": yearly_df["pmi_exp_sum"].sum(),
+        "Total Taxes Paid": yearly_df["property_tax_exp_sum"].sum(),
+        "Total Interest Paid": yearly_df["interest_exp_sum"].sum(),
+    }
+
+
+def get_break_even_year(ownership_upside):
+    """
+    First year in which owning beats renting, i.e. ownership_upside is positive, or NaN if it
+    never does. Works on a yearly column or on (..., n_years) arrays of many scenarios.
+    """
+    positive = np.asarray(ownership_upside) > 0
+    years = np.where(positive.any(axis=-1), positive.argmax(axis=-1), np.nan)
+    return years if years.ndim else float(years)
+
+
+def get_inputs_extra_payments_comparison(inputs: Inputs, yearly: dict, stage_cache=None):
+    """
+    Extra payments comparison arrays of the inputs, or None when no extra payments are
+    configured. Only the interest of the loan without extra payments is needed for it.
+    """
+    if not (inputs.mo_extra_payment and inputs.num_extra_payments):
+        return None
+    baseline_loan = run_profiled("baseline_loan_schedule", get_inputs_loan_schedule, inputs, False, stage_cache)
+    yearly_no_extra = {"interest_exp_sum": baseline_loan["interest_exp"].reshape(-1, 12).sum(axis=-1)}
+    return run_profiled("extra_payments_comparison", get_extra_payments_comparison_arrays, yearly, yearly_no_extra)
+
+
+def get_simulation_arrays(inputs: Inputs, stage_cache=None) -> dict:
+    """
+    get_all_simulation_data without the frames. yearly is a dict of yearly column arrays, and
+    extra_payments_comparison a dict of comparison arrays when extra payments are configured.
+    """
+    monthly_sim = get_monthly_sim(inputs, extra_payments=True, stage_cache=stage_cache)
+    yearly = run_profiled("yearly_aggregation", get_yearly_agg_arrays, inputs, monthly_sim.columns)
+    arrays = {
+        "yearly": yearly,
+        "mortgage_metrics": run_profiled("mortgage_metrics", get_mortgage_metrics, yearly),
+    }
+    comparison = get_inputs_extra_payments_comparison(inputs, yearly, stage_cache)
+    if comparison is not None:
+        arrays["extra_payments_comparison"] = comparison
+    return arrays
+
+
+def get_simulation_summary(inputs: Inputs) -> dict:
+    """The monthly payment, the cash needed to buy, the mortgage metrics and the sweep metrics"""
+    yearly = get_simulation_arrays(inputs)["yearly"]
+    return {
+        "Monthly Payment": inputs.mo_amortized,
+        "Cash Outlay": inputs.cash_outlay,
+        **get_mortgage_metrics(yearly),
+        "Final Ownership Upside": yearly["ownership_upside"][-1],
+        "Break Even Year": get_break_even_year(yearly["ownership_upside"]),
+    }
+
+
+BOOL_ARGS = {"true": True, "yes": True, "1": True, "false": False, "no": False, "0": False}
+
+
+def parse_input_field(value: str) -> tuple:
+    """
+    argparse type of FIELD=VALUE arguments that set an Inputs field. Values of bool fields are
+    true or false, every other value is a number.
+    """
+    field_name, sep, field_value = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected FIELD=VALUE, got {value}")
+    try:
+        check_input_field(field_name)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+    if Inputs.__dataclass_fields__[field_name].type is bool:
+        if field_value.lower() not in BOOL_ARGS:
+            raise argparse.ArgumentTypeError(f"Expected true or false for {field_name}, got {field_value}")
+        return field_name, BOOL_ARGS[field_value.lower()]
+    try:
+        return field_name, float(field_value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected a number for {field_name}, got {field_value}") from None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monthly payment and summary metrics of a home purchase")
+    parser.add_argument(
+        "--set",
+        type=parse_input_field,
+        action="append",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="Set an Inputs field, e.g. home_price=400000. Repeatable.",
+    )
+    parser.add_argument("--payment-only", action="store_true", help="Only print the monthly payment")
+    args = parser.parse_args(argv)
+
+    try:
+        inputs = replace(Inputs(), **dict(args.set))
+    except ValueError as e:
+        parser.error(str(e))
+    summary = {"Monthly Payment": inputs.mo_amortized} if args.payment_only else get_simulation_summary(inputs)
+    for name, value in summary.items():
+        print(f"{name}: {value:,.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Streaming evaluation of listing files. Reads a CSV or Parquet file of listings in chunks, maps
+its columns onto Inputs fields, runs the batched simulation per chunk and appends one row of
+summary metrics per listing to a CSV output as it goes. Memory is bounded by the chunk size.
+
+A listing that does not make valid Inputs, e.g. a price that is not a number, is not simulated.
+Its metrics are left empty and the reason is written to the error column, the rest of the file
+is still evaluated.
+
+Progress is recorded next to the output after every chunk, so an interrupted run can resume
+from the last completed chunk.
+
+python -m mortgage_calculator.listings listings.csv metrics.csv \\
+    --column price=home_price --column hoa=mo_hoa_fees --column rent=mo_rent_comparison_exp
+"""
+
+import argparse
+import json
+import os
+from dataclasses import replace
+from typing import TYPE_CHECKING, Iterator
+
+import numpy as np
+
+from mortgage_calculator.calculator import Inputs, check_input_field, parse_input_field
+from mortgage_calculator.sweep import get_sweep_metrics
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def iter_listing_chunks(path: str, chunk_size: int) -> Iterator["pd.DataFrame"]:
+    """Reads a .csv or .parquet file chunk_size rows at a time"""
+
+    import pandas as pd
+
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Reading parquet listings requires pyarrow") from e
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def get_listing_overrides(chunk: "pd.DataFrame", column_map: dict) -> list:
+    """
+    Inputs field overrides for every listing in the chunk. column_map maps file columns to
+    Inputs fields. Missing values fall back to the base inputs.
+    """
+    import pandas as pd
+
+    mapped = chunk[list(column_map)].rename(columns=column_map)
+    return [
+        {field: value for field, value in row.items() if pd.notna(value)}
+        for row in mapped.to_dict("records")
+    ]
+
+
+def _get_listing_point(base: Inputs, overrides: dict) -> dict:
+    """
+    Overrides of one listing with numeric text such as "300000" converted to numbers. Raises a
+    ValueError or TypeError if they do not make valid Inputs.
+    """
+    point = {}
+    for field, value in overrides.items():
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f"{field} must be a number, got {value!r}") from None
+        point[field] = value
+    replace(base, **point) # Raises for invalid inputs, e.g. a loan term that is not whole years
+    return point
+
+
+def evaluate_listings_chunk(chunk: "pd.DataFrame", column_map: dict, base: Inputs) -> "pd.DataFrame":
+    """
+    Summary metrics for every listing in the chunk, alongside its mapped columns and an error
+    column. Invalid listings get empty metrics and the reason in the error column.
+    """
+    points, errors = [], []
+    for overrides in get_listing_overrides(chunk, column_map):
+        try:
+            points.append(_get_listing_point(base, overrides))
+            errors.append("")
+        except (ValueError, TypeError) as error:
+            points.append(None)
+            errors.append(str(error))
+
+    valid = np.array([point is not None for point in points], dtype=bool)
+    # A chunk without valid listings still needs every metric column
+    metrics = get_sweep_metrics(base, [point for point in points if point is not None] or [{}])
+
+    out_df = chunk[list(column_map)].copy()
+    for name, values in metrics.items():
+        column = np.full(len(points), np.nan)
+        column[valid] = values[:valid.sum()]
+        out_df[name] = column
+    out_df["error"] = errors
+    return out_df
+
+
+def _read_progress(progress_path: str) -> dict:
+    if not os.path.exists(progress_path):
+        return {"completed_chunks": 0, "output_bytes": 0}
+    with open(progress_path) as f:
+        return json.load(f)
+
+
+def _write_progress(progress_path: str, progress: dict):
+    tmp_path = progress_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+
+def evaluate_listings(
+    input_path: str,
+    output_path: str,
+    column_map: dict,
+    base: Inputs = None,
+    chunk_size: int = 1000,
+    resume: bool = False,
+) -> int:
+    """
+    Evaluates every listing in input_path and writes its summary metrics to the CSV
+    output_path: the get_mortgage_metrics totals, the final ownership_upside and the break even
+    year. Fields not in column_map come from base, which defaults to Inputs().
+
+    With resume=True, chunks completed by an earlier run are skipped and anything written
+    after the last completed chunk is discarded. The chunk size must match the earlier run.
+    Returns the number of listings written by this call.
+    """
+
+    import pandas as pd
+
+    for field in column_map.values():
+        check_input_field(field)
+    base = Inputs() if base is None else base
+    progress_path = output_path + ".progress"
+
+    progress = _read_progress(progress_path) if resume else {"completed_chunks": 0, "output_bytes": 0}
+    if resume and progress.get("chunk_size", chunk_size) != chunk_size:
+        raise ValueError("chunk_size must match the run being resumed")
+    progress["chunk_size"] = chunk_size
+
+    # Drop a partially written chunk from a crashed run
+    with open(output_path, "ab") as f:
+        f.truncate(progress["output_bytes"])
+
+    n_written = 0
+    for i, chunk in enumerate(iter_listing_chunks(input_path, chunk_size)):
+        if i < progress["completed_chunks"]:
+            continue
+
+        # Number rows by their position in the file, whatever the reader's own index is
+        chunk.index = pd.RangeIndex(i * chunk_size, i * chunk_size + len(chunk))
+        out_df = evaluate_listings_chunk(chunk, column_map, base)
+        with open(output_path, "a", newline="") as f:
+            out_df.to_csv(f, header=progress["output_bytes"] == 0, index_label="row")
+            f.flush()
+            os.fsync(f.fileno())
+            progress["output_bytes"] = f.tell()
+
+        progress["completed_chunks"] = i + 1
+        _write_progress(progress_path, progress)
+        n_written += len(out_df)
+
+    return n_written
+
+
+def _parse_column(value: str) -> tuple:
+    column, _, field = value.partition("=")
+    if not field:
+        raise argparse.ArgumentTypeError(f"Expected COLUMN=FIELD, got {value}")
+    try:
+        check_input_field(field)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+    return column, field
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a file of listings with the mortgage simulation")
+    parser.add_argument("input", help="Listings .csv or .parquet file")
+    parser.add_argument("output", help="CSV file the per listing metrics are appended to")
+    parser.add_argument(
+        "--column",
+        type=_parse_column,
+        action="append",
+        default=[],
+        metavar="COLUMN=FIELD",
+        help="Map a listings column onto an Inputs field, e.g. price=home_price. Repeatable.",
+    )
+    parser.add_argument(
+        "--set",
+        type=parse_input_field,
+        action="append",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="Override a base Inputs field for every listing, e.g. interest_rate=0.07. Repeatable.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run")
+    args = parser.parse_args(argv)
+
+    try:
+        base = replace(Inputs(), **dict(args.set))
+    except ValueError as e:
+        parser.error(str(e))
+
+    n_written = evaluate_listings(
+        args.input,
+        args.output,
+        dict(args.column),
+        base=base,
+        chunk_size=args.chunk_size,
+        resume=args.resume,
+    )
+    print(f"Wrote {n_written} listings to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
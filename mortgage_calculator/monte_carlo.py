@@ -0,0 +1,232 @@
+"""
+Monte Carlo simulation. Instead of a single deterministic rate, home appreciation, inflation,
+rent growth and the portfolio returns follow sampled yearly paths, and the yearly metrics are
+summarized as percentile bands across all paths.
+
+Rates are sampled per year because the simulation resets expenses and rent once a year. Within
+a year the rate is applied monthly like the deterministic simulation does.
+"""
+
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+from mortgage_calculator.calculator import (
+    Inputs,
+    MONTHLY_COLUMNS,
+    get_inputs_loan_schedule,
+    get_pmi_schedule,
+    get_ownership_columns,
+    get_portfolio_columns,
+    get_yearly_agg_arrays,
+)
+from mortgage_calculator.utils import add_growth
+
+
+# Inputs fields that can follow a sampled path. The order fixes which RNG stream each factor
+# gets, so adding a model for one factor never changes the draws of another.
+MONTE_CARLO_FACTORS = [
+    "yr_home_appreciation",
+    "yr_inflation_rate",
+    "yr_rent_increase",
+    "rent_surplus_portfolio_growth",
+    "extra_payments_portfolio_growth",
+]
+
+DEFAULT_METRICS = [
+    "ownership_upside",
+    "net_worth_from_owning",
+    "net_worth_from_renting",
+    "equity",
+    "home_value_max",
+    "rent_comparison_portfolio_max",
+    "extra_payments_portfolio_max",
+]
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+@dataclass
+class LognormalModel:
+    """
+    Yearly growth where 1 + rate is lognormal. mean is the expected yearly rate and volatility
+    the standard deviation of the log growth.
+    """
+    mean: float
+    volatility: float
+
+    def sample(self, rng: np.random.Generator, n_paths: int, n_years: int) -> np.ndarray:
+        mu = np.log1p(self.mean) - self.volatility**2 / 2
+        return np.expm1(rng.normal(mu, self.volatility, size=(n_paths, n_years)))
+
+
+@dataclass
+class BootstrapModel:
+    """Yearly rates drawn with replacement from a supplied history of yearly rates"""
+    history: Sequence[float]
+
+    def sample(self, rng: np.random.Generator, n_paths: int, n_years: int) -> np.ndarray:
+        return rng.choice(np.asarray(self.history, dtype=float), size=(n_paths, n_years))
+
+
+def sample_paths(inputs: Inputs, models: dict, n_paths: int, seed=None) -> dict:
+    """
+    Returns one (n_paths, n_years) array of yearly rates per factor in MONTE_CARLO_FACTORS.
+    Factors without a model keep the deterministic rate from the inputs.
+    """
+
+    unknown = set(models) - set(MONTE_CARLO_FACTORS)
+    if unknown:
+        raise ValueError(f"No Monte Carlo factor named {sorted(unknown)}")
+
+    n_years = inputs.horizon_years
+    streams = np.random.SeedSequence(seed).spawn(len(MONTE_CARLO_FACTORS))
+
+    paths = {}
+    for factor, stream in zip(MONTE_CARLO_FACTORS, streams):
+        if factor in models:
+            paths[factor] = models[factor].sample(np.random.default_rng(stream), n_paths, n_years)
+        else:
+            paths[factor] = np.full((n_paths, n_years), getattr(inputs, factor), dtype=float)
+    return paths
+
+
+def get_path_monthly_sim(inputs: Inputs, paths: dict) -> dict:
+    """
+    Monthly simulation with extra payments for every path at once. Returns a dict with one
+    (n_paths, n_months) array per monthly column.
+
+    The loan does not depend on any sampled factor, so its schedule is computed once and shared
+    by every path.
+    """
+
+    n_paths, n_years = paths["yr_home_appreciation"].shape
+    shape = (n_paths, n_years * 12)
+
+    def monthly(rates):
+        return np.repeat(add_growth(1, rates, months=1), 12, axis=-1)
+
+    def yearly_steps(value, rates):
+        # Value during year y grew with the rates of years 0..y-1
+        growth = np.cumprod(add_growth(1, rates[:, :-1], months=12), axis=-1)
+        return np.repeat(value * np.concatenate([np.ones((n_paths, 1)), growth], axis=-1), 12, axis=-1)
+
+    ########################################################################
+    #      Home Value and Yearly Expenses                                  #
+    ########################################################################
+
+    start_home_value = inputs.home_price * np.concatenate(
+        [np.ones((n_paths, 1)), np.cumprod(monthly(paths["yr_home_appreciation"]), axis=-1)],
+        axis=-1
+    )
+    home_value = start_home_value[:, 1:]
+    start_home_value = start_home_value[:, :-1]
+    year_home_value = np.repeat(start_home_value[:, ::12], 12, axis=-1)
+
+    property_tax_exp = year_home_value * inputs.yr_property_tax_rate / 12
+    insurance_exp = year_home_value * inputs.yr_insurance_rate / 12
+    maintenance_exp = year_home_value * inputs.yr_maintenance / 12
+    hoa_exp = yearly_steps(inputs.mo_hoa_fees, paths["yr_inflation_rate"])
+    utility_exp = yearly_steps(inputs.mo_utility, paths["yr_inflation_rate"])
+    rent_comparison_exp = yearly_steps(inputs.mo_rent_comparison_exp, paths["yr_rent_increase"])
+
+    ########################################################################
+    #      Loan, PMI and Portfolios                                        #
+    ########################################################################
+
+    loan = get_inputs_loan_schedule(inputs, extra_payments=True)
+    pmi_exp = get_pmi_schedule(inputs, start_home_value, loan["loan_balance"])
+
+    columns = {
+        **loan,
+        "property_tax_exp": property_tax_exp,
+        "insurance_exp": insurance_exp,
+        "hoa_exp": hoa_exp,
+        "maintenance_exp": maintenance_exp,
+        "pmi_exp": pmi_exp,
+        "utility_exp": utility_exp,
+        "home_value": home_value,
+        "rent_comparison_exp": rent_comparison_exp,
+    }
+    columns.update(get_ownership_columns(columns))
+    columns.update(get_portfolio_columns(
+        inputs,
+        columns,
+        growth_rates={
+            "rent_comparison_portfolio": np.repeat(paths["rent_surplus_portfolio_growth"], 12, axis=-1),
+            "extra_payments_portfolio": np.repeat(paths["extra_payments_portfolio_growth"], 12, axis=-1),
+        },
+    ))
+    return {col: np.broadcast_to(columns[col], shape) for col in MONTHLY_COLUMNS}
+
+def get_monte_carlo_yearly_arrays(
+    inputs: Inputs,
+    models: dict,
+    n_paths: int = 10000,
+    seed=None,
+    metrics: Sequence[str] = DEFAULT_METRICS,
+    chunk_size: int = 1000,
+) -> dict:
+    """
+    Returns one (n_paths, n_years) array per yearly metric. Paths are sampled up front and
+    simulated in chunks of chunk_size, so memory is bounded by the chunk and results do not
+    depend on the chunk size.
+    """
+
+    paths = sample_paths(inputs, models, n_paths, seed)
+    yearly = {metric: np.empty((n_paths, inputs.horizon_years)) for metric in metrics}
+
+    for start in range(0, n_paths, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        monthly = get_path_monthly_sim(inputs, {factor: values[chunk] for factor, values in paths.items()})
+        chunk_yearly = get_yearly_agg_arrays(inputs, monthly)
+        for metric in metrics:
+            yearly[metric][chunk] = chunk_yearly[metric]
+
+    return yearly
+
+
+def get_monte_carlo_simulation_data(
+    inputs: Inputs,
+    models: dict,
+    n_paths: int = 10000,
+    seed=None,
+    metrics: Sequence[str] = DEFAULT_METRICS,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    chunk_size: int = 1000,
+) -> dict:
+    """
+    Runs the Monte Carlo simulation and summarizes it. models maps factors in
+    MONTE_CARLO_FACTORS to a LognormalModel, BootstrapModel or any object with the same
+    sample(rng, n_paths, n_years) method.
+
+    Returns a dict with
+    - percentiles_df: yearly frame with (metric, percentile) columns, e.g. ("ownership_upside", 50)
+    - prob_positive_upside: probability that ownership_upside is positive in each year
+    """
+
+    import pandas as pd
+
+    if "ownership_upside" not in metrics:
+        metrics = list(metrics) + ["ownership_upside"]
+
+    yearly = get_monte_carlo_yearly_arrays(inputs, models, n_paths, seed, metrics, chunk_size)
+    index = pd.Index(np.arange(inputs.horizon_years), name="year")
+
+    bands = {
+        (metric, percentile): values
+        for metric in metrics
+        for percentile, values in zip(percentiles, np.percentile(yearly[metric], percentiles, axis=0))
+    }
+    percentiles_df = pd.DataFrame(bands, index=index)
+    percentiles_df.columns.names = ["metric", "percentile"]
+
+    return {
+        "percentiles_df": percentiles_df,
+        "prob_positive_upside": pd.Series(
+            (yearly["ownership_upside"] > 0).mean(axis=0),
+            index=index,
+            name="prob_positive_upside"
+        ),
+    }
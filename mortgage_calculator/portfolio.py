@@ -0,0 +1,209 @@
+"""
+Multi property portfolio simulation. An investor buys several properties at different months,
+collects rent on them and sells each one at the end of its horizon. Every property is simulated
+on its own clock by the batched engine, then shifted onto a shared monthly clock where all cash
+flows meet in one cash account.
+
+The cash account pays the cash outlay of every purchase and the monthly expenses of every
+property, and receives rental income, sale proceeds and equity draws. It grows at
+cash_growth_rate. When it would go negative the investor contributes the shortfall, so later
+down payments are funded from earlier income and sales first. An EquityDraw takes equity out of
+a property with a cash out refinance, e.g. to fund the next down payment.
+
+properties = [Property(Inputs(), start_month=0, mo_rental_income=2000), Property(Inputs(), start_month=24)]
+results = simulate_portfolio(properties, draws=[EquityDraw(month=23, property=0, amount=30000)])
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from mortgage_calculator.calculator import Inputs, get_inputs_home_schedule, get_yearly_column_aggs
+from mortgage_calculator.batch import get_batch_monthly_sim, stack_inputs
+from mortgage_calculator.refinance import Refinance, RefinanceCheckpoint, get_refinance_monthly_sim
+from mortgage_calculator.tax import get_yearly_taxes
+from mortgage_calculator.utils import add_growth
+
+
+# Per property columns, on the shared clock, that the consolidated series are built from
+PROPERTY_COLUMNS = ["home_value", "loan_balance", "total_exp", "rental_income"]
+
+
+@dataclass(frozen=True)
+class Property:
+    inputs: Inputs
+    start_month: int = 0 # Month of the shared clock the property is bought in
+    mo_rental_income: float = 0 # Grows once a year with inputs.yr_rent_increase
+
+
+@dataclass(frozen=True)
+class EquityDraw:
+    """Cash out refinance of a property, at its original rate unless interest_rate is given"""
+    month: int # Month of the shared clock
+    property: int # Index of the property in the properties list
+    amount: float
+    interest_rate: float = None
+
+
+def get_property_monthly(properties: list, draws=()) -> dict:
+    """
+    Monthly columns of every property on its own clock, (n_properties, n_months) arrays. The
+    properties are simulated together by the batched engine, and only properties with equity
+    draws are rerun with the refinances from the draw month on.
+    """
+
+    inputs_list = [prop.inputs for prop in properties]
+    monthly = get_batch_monthly_sim(inputs_list, extra_payments=True)
+
+    for i in sorted({draw.property for draw in draws}):
+        prop = properties[i]
+        inputs = prop.inputs
+        n_months = 12 * int(inputs.horizon_years)
+        checkpoint = RefinanceCheckpoint(
+            inputs,
+            get_inputs_home_schedule(inputs),
+            {col: values[i, :n_months] for col, values in monthly.items()},
+        )
+        for draw in sorted((draw for draw in draws if draw.property == i), key=lambda draw: draw.month):
+            rate = inputs.interest_rate if draw.interest_rate is None else draw.interest_rate
+            refinance = Refinance(draw.month - prop.start_month, rate, cash_out=draw.amount)
+            checkpoint.monthly = get_refinance_monthly_sim(checkpoint, refinance).columns
+        for col, values in checkpoint.monthly.items():
+            monthly[col][i, :n_months] = values
+
+    return monthly
+
+
+def simulate_portfolio(properties, draws=(), initial_cash: float = 0, cash_growth_rate: float = 0.04) -> dict:
+    """
+    Steps every property on a shared monthly clock that runs until the last sale. Returns a
+    dict with
+    - monthly_df: consolidated series per month of the shared clock
+    - yearly_df: the same per year, flows summed and balances at the end of the year
+    - property_arrays: (n_properties, n_months) arrays of PROPERTY_COLUMNS on the shared clock,
+      zero while a property is not held. Home value and loan balance are zero from the sale
+      month on, when the property's equity has moved into the cash account.
+
+    Every month the cash account receives the net cash flow: rental income, sale proceeds and
+    equity draws minus property expenses and purchase cash outlays. Sale proceeds are the home
+    value less the loan balance, realtor fee and home sale tax, like the yearly net worth.
+    """
+
+    import pandas as pd
+
+    properties = list(properties)
+    draws = list(draws)
+    n = len(properties)
+    for i, prop in enumerate(properties):
+        if prop.start_month < 0 or prop.start_month != int(prop.start_month):
+            raise ValueError(f"Property {i} starts in month {prop.start_month}, start months are whole months from 0")
+    for draw in draws:
+        prop = properties[draw.property]
+        if not 0 <= draw.month - prop.start_month < 12 * prop.inputs.horizon_years:
+            raise ValueError(f"Equity draw in month {draw.month} is outside the holding period of property {draw.property}")
+
+    p = stack_inputs([prop.inputs for prop in properties])
+    start_month = np.array([prop.start_month for prop in properties])[:, None]
+    held_months = 12 * p.horizon_years.astype(int)
+    n_months = int((start_month + held_months).max())
+
+    local = get_property_monthly(properties, draws)
+    n_local = local["loan_balance"].shape[1]
+
+    rental_income = (
+        np.array([prop.mo_rental_income for prop in properties])[:, None] *
+        add_growth(1, p.yr_rent_increase, months=12) ** (np.arange(n_local) // 12)
+    )
+    local = {**local, "rental_income": rental_income}
+
+    ########################################################################
+    #      Shift every property onto the shared clock                      #
+    ########################################################################
+
+    # Expenses and income run through the sale month, the home itself is gone once it is sold
+    local_month = np.arange(n_local)
+    held = local_month < held_months
+    owned = local_month < held_months - 1
+
+    property_arrays = {}
+    for col in PROPERTY_COLUMNS:
+        mask = owned if col in ["home_value", "loan_balance"] else held
+        rows = np.broadcast_to(np.arange(n)[:, None], mask.shape)[mask]
+        cols = np.broadcast_to(start_month + local_month, mask.shape)[mask]
+        shared = np.zeros((n, n_months))
+        shared[rows, cols] = local[col][mask]
+        property_arrays[col] = shared
+
+    purchases = np.zeros(n_months)
+    np.add.at(purchases, start_month[:, 0], p.cash_outlay[:, 0])
+
+    # Sold at the end of the last month held, taxed like the yearly net worth
+    last = held_months[:, 0] - 1
+    sale_value = local["home_value"][np.arange(n), last]
+    home_sale_tax = get_yearly_taxes(p, get_yearly_column_aggs(local))["home_sale_tax"]
+    sale_proceeds_by_property = (
+        sale_value
+        - local["loan_balance"][np.arange(n), last]
+        - sale_value * p.realtor_rate[:, 0]
+        - home_sale_tax[np.arange(n), last // 12]
+    )
+    sale_proceeds = np.zeros(n_months)
+    np.add.at(sale_proceeds, start_month[:, 0] + last, sale_proceeds_by_property)
+
+    equity_draws = np.zeros(n_months)
+    for draw in draws:
+        equity_draws[draw.month] += draw.amount
+
+    rental_income = property_arrays["rental_income"].sum(axis=0)
+    property_exp = property_arrays["total_exp"].sum(axis=0)
+    net_cash_flow = rental_income + sale_proceeds + equity_draws - property_exp - purchases
+
+    ########################################################################
+    #      Cash account                                                    #
+    ########################################################################
+
+    # The shortfall floor makes every month depend on the last, so this one loop is sequential
+    monthly_growth = add_growth(1, cash_growth_rate, months=1)
+    cash_balance = np.empty(n_months)
+    external_contributions = np.zeros(n_months)
+    cash = initial_cash
+    for month in range(n_months):
+        cash += net_cash_flow[month]
+        if cash < 0:
+            external_contributions[month] = -cash
+            cash = 0.0
+        cash *= monthly_growth
+        cash_balance[month] = cash
+
+    home_value = property_arrays["home_value"].sum(axis=0)
+    loan_balance = property_arrays["loan_balance"].sum(axis=0)
+
+    monthly_df = pd.DataFrame({
+        "year": np.arange(n_months) // 12,
+        "properties_held": (property_arrays["home_value"] > 0).sum(axis=0),
+        "home_value": home_value,
+        "loan_balance": loan_balance,
+        "equity": home_value - loan_balance,
+        "rental_income": rental_income,
+        "property_exp": property_exp,
+        "purchases": purchases,
+        "sale_proceeds": sale_proceeds,
+        "equity_draws": equity_draws,
+        "net_cash_flow": net_cash_flow,
+        "external_contributions": external_contributions,
+        "cash_balance": cash_balance,
+        "net_worth": cash_balance + home_value - loan_balance,
+    })
+    monthly_df.index.name = "month"
+
+    flows = ["rental_income", "property_exp", "purchases", "sale_proceeds", "equity_draws", "net_cash_flow", "external_contributions"]
+    yearly_df = monthly_df.groupby("year").agg({
+        col: "sum" if col in flows else "last"
+        for col in monthly_df.columns if col != "year"
+    })
+
+    return {
+        "monthly_df": monthly_df,
+        "yearly_df": yearly_df,
+        "property_arrays": property_arrays,
+    }
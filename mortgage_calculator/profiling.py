@@ -0,0 +1,93 @@
+"""
+Opt in per stage profiling of the simulation. Every stage of get_monthly_sim_df and
+get_all_simulation_data (the home and loan schedules, assembling the monthly columns, the
+yearly aggregation, building the frames, ...) reports its wall time and the number of rows it
+produced to the registered sinks.
+
+with profile_stages() as profile:
+    get_all_simulation_data(Inputs())
+profile.to_dict()
+
+A sink is any callable taking (stage, seconds, rows), e.g. a function that forwards the timings
+to a metrics pipeline, registered with add_sink or passed to profile_stages. Sinks are global,
+so stages run on any thread while a sink is registered are reported to it. With no sinks
+registered a stage costs a single check and no timing is done.
+"""
+
+import time
+from contextlib import contextmanager
+
+
+# Registered sinks. Replaced rather than mutated so stages can iterate it without a lock.
+_sinks = ()
+
+
+def add_sink(sink):
+    """Registers a callable taking (stage, seconds, rows) that receives every stage timing"""
+    global _sinks
+    _sinks = _sinks + (sink,)
+
+
+def remove_sink(sink):
+    global _sinks
+    _sinks = tuple(s for s in _sinks if s is not sink)
+
+
+def is_profiling() -> bool:
+    return bool(_sinks)
+
+
+def get_n_rows(result) -> int:
+    """Rows produced by a stage: the length of a frame or MonthlySim, or of the first column of a dict"""
+    if isinstance(result, dict):
+        result = next(iter(result.values()), ())
+    return len(result) if hasattr(result, "__len__") else 1
+
+
+def run_profiled(stage: str, compute, *args):
+    """Returns compute(*args), reporting its time and row count to the sinks when profiling"""
+    if not _sinks:
+        return compute(*args)
+
+    start = time.perf_counter()
+    result = compute(*args)
+    seconds = time.perf_counter() - start
+
+    rows = get_n_rows(result)
+    for sink in _sinks:
+        sink(stage, seconds, rows)
+    return result
+
+
+class StageProfile:
+    """Sink that keeps every stage timing it receives"""
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, stage: str, seconds: float, rows: int):
+        self.records.append({"stage": stage, "seconds": seconds, "rows": rows})
+
+    def to_dict(self) -> dict:
+        """Calls, total seconds and rows of the last call per stage, in the order stages first ran"""
+        stages = {}
+        for record in self.records:
+            stats = stages.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "rows": 0})
+            stats["calls"] += 1
+            stats["seconds"] += record["seconds"]
+            stats["rows"] = record["rows"]
+        return stages
+
+
+@contextmanager
+def profile_stages(sink=None):
+    """
+    Reports every stage run inside the block to sink, a new StageProfile by default, and
+    yields the sink.
+    """
+    sink = StageProfile() if sink is None else sink
+    add_sink(sink)
+    try:
+        yield sink
+    finally:
+        remove_sink(sink)
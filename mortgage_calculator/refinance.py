@@ -0,0 +1,214 @@
+"""
+Refinance scenarios. A refinance replaces the remaining balance of the loan at a given month
+with a new loan at a new rate and term, paying closing costs in cash.
+
+Everything before the refinance is the same for every refinance timing, so the simulation
+without refinancing is run once and kept as a RefinanceCheckpoint. Each timing only computes
+the new loan from the refinance month on, and the PMI, totals and portfolios from the start of
+that year on, continuing from the checkpointed state.
+
+get_optimal_refinance evaluates every timing over a grid of rates and reports the best month to
+refinance at and the month the refinance pays for itself.
+"""
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from mortgage_calculator.calculator import (
+    Inputs,
+    MonthlySim,
+    get_inputs_home_schedule,
+    get_inputs_loan_schedule,
+    get_loan_schedule,
+    assemble_monthly_sim,
+    get_pmi_schedule,
+    get_ownership_columns,
+    get_portfolio_columns,
+    get_yearly_agg_arrays,
+    yearly_arrays_to_df,
+    get_mortgage_metrics,
+)
+from mortgage_calculator.utils import get_amortization_payment, get_monthly_pmi_array
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass
+class Refinance:
+    month: int # First month paid on the new loan, 0 is the first month after closing
+    interest_rate: float
+    closing_costs: float = 0 # Paid in cash in the refinance month
+    term_years: int = None # Defaults to the term of the original loan
+    # Borrowed on top of the remaining balance and paid out to the owner. Only the portfolio
+    # simulation tracks where the cash goes, single property results only see the larger loan.
+    cash_out: float = 0
+
+
+@dataclass
+class RefinanceCheckpoint:
+    """Simulation without refinancing, shared by every refinance timing of the inputs"""
+    inputs: Inputs
+    home: dict
+    monthly: dict
+
+
+def get_refinance_checkpoint(inputs: Inputs, stage_cache=None) -> RefinanceCheckpoint:
+    """Simulates the inputs with extra payments and no refinance"""
+    home = get_inputs_home_schedule(inputs, stage_cache)
+    loan = get_inputs_loan_schedule(inputs, extra_payments=True, stage_cache=stage_cache)
+    return RefinanceCheckpoint(inputs, home, assemble_monthly_sim(inputs, home, loan).columns)
+
+
+def get_refinanced_loan_schedule(checkpoint: RefinanceCheckpoint, refinance: Refinance) -> dict:
+    """Loan schedule of the new loan, for the months from the refinance on"""
+
+    inputs = checkpoint.inputs
+    month = refinance.month
+    n_months = len(checkpoint.monthly["loan_balance"])
+    if not 0 <= month < n_months:
+        raise ValueError(f"Refinance month must be between 0 and {n_months - 1}")
+
+    balance = inputs.loan_amount if month == 0 else checkpoint.monthly["loan_balance"][month - 1]
+    balance += refinance.cash_out
+    term_years = inputs.loan_term_years if refinance.term_years is None else refinance.term_years
+    mo_amortized = get_amortization_payment(balance, refinance.interest_rate, term_years)
+
+    # Extra payments keep counting from closing, not from the refinance
+    return get_loan_schedule(
+        balance,
+        refinance.interest_rate,
+        mo_amortized,
+        inputs.mo_extra_payment,
+        max(0, inputs.num_extra_payments - month),
+        True,
+        n_months - month,
+        12 * int(term_years),
+    )
+
+
+def get_refinance_monthly_sim(checkpoint: RefinanceCheckpoint, refinance: Refinance) -> MonthlySim:
+    """
+    Monthly simulation with the refinance, built on the checkpoint. The refinance closing costs
+    are part of ownership_exp in the refinance month.
+    """
+
+    inputs = checkpoint.inputs
+    home = checkpoint.home
+    prefix = checkpoint.monthly
+    month = refinance.month
+    loan = get_refinanced_loan_schedule(checkpoint, refinance)
+
+    # PMI and the yearly expense resets work on whole years, continue from the refinance year
+    start = 12 * (month // 12)
+    loan = {
+        col: np.concatenate([prefix[col][start:month], values])
+        for col, values in loan.items()
+    }
+
+    initial_pmi = None
+    if start > 0:
+        initial_pmi = get_monthly_pmi_array(
+            home["start_home_value"][start - 1],
+            prefix["loan_balance"][start - 1],
+            inputs.pmi_rate,
+            inputs.home_price
+        )
+    pmi_exp = get_pmi_schedule(inputs, home["start_home_value"][start:], loan["loan_balance"], initial_pmi)
+
+    closing_costs = np.zeros(len(pmi_exp))
+    closing_costs[month - start] = refinance.closing_costs
+
+    # Every column from the start of the refinance year on, recomputed with the new loan
+    window = {col: values[start:] for col, values in prefix.items()}
+    window.update(loan, pmi_exp=pmi_exp)
+    window.update(get_ownership_columns(window, closing_costs))
+    window.update(get_portfolio_columns(
+        inputs,
+        window,
+        initial_values={
+            "rent_comparison_portfolio": prefix["rent_comparison_portfolio"][start - 1] if start > 0 else inputs.cash_outlay,
+            "extra_payments_portfolio": prefix["extra_payments_portfolio"][start - 1] if start > 0 else 0,
+        },
+    ))
+
+    refinanced = [*loan, "pmi_exp", "ownership_exp", "total_exp", "rent_comparison_portfolio", "extra_payments_portfolio"]
+    return MonthlySim({
+        col: np.concatenate([values[:start], window[col]]) if col in refinanced else values
+        for col, values in prefix.items()
+    })
+
+
+def get_refinance_simulation_data(inputs: Inputs, refinance: Refinance) -> dict:
+    """get_all_simulation_data with a refinance, returns yearly_df and mortgage_metrics"""
+    monthly = get_refinance_monthly_sim(get_refinance_checkpoint(inputs), refinance)
+    yearly = get_yearly_agg_arrays(inputs, monthly.columns)
+    return {
+        "yearly_df": yearly_arrays_to_df(yearly),
+        "mortgage_metrics": get_mortgage_metrics(yearly),
+    }
+
+
+def get_break_even_month(checkpoint: RefinanceCheckpoint, monthly: MonthlySim, month: int) -> float:
+    """
+    First month in which the cumulative ownership expenses saved by a refinance at month,
+    e.g. lower interest and PMI, cover its closing costs, or NaN if they never do.
+    """
+    savings = np.cumsum(checkpoint.monthly["ownership_exp"][month:] - monthly["ownership_exp"][month:])
+    covered = np.flatnonzero(savings >= 0)
+    return float(month + covered[0]) if covered.size else np.nan
+
+
+def get_optimal_refinance(
+    inputs: Inputs,
+    rates,
+    closing_costs: float = 0,
+    term_years: int = None,
+    months=None,
+) -> "pd.DataFrame":
+    """
+    Evaluates refinancing at every month in months to every rate in rates. The best month is
+    the one with the highest final ownership_upside. months defaults to months 1 through the end
+    of the horizon. Month 0 would mean taking the new rate at closing, which wins trivially.
+
+    Returns a frame indexed by rate with the optimal_month, its final_ownership_upside, the
+    upside_gain over not refinancing and the break_even_month at which the refinance has paid
+    for itself. optimal_month is NaN for rates where no timing beats not refinancing.
+    """
+
+    import pandas as pd
+
+    checkpoint = get_refinance_checkpoint(inputs)
+    n_months = len(checkpoint.monthly["loan_balance"])
+    months = np.arange(1, n_months) if months is None else np.asarray(months, dtype=int)
+    baseline_upside = get_yearly_agg_arrays(inputs, checkpoint.monthly)["ownership_upside"][-1]
+
+    rows = []
+    for rate in rates:
+        sims = [
+            get_refinance_monthly_sim(checkpoint, Refinance(month, rate, closing_costs, term_years))
+            for month in months
+        ]
+
+        # Aggregate every timing at once as (n_timings, n_months) arrays
+        stacked = {col: np.stack([sim[col] for sim in sims]) for col in checkpoint.monthly}
+        final_upside = get_yearly_agg_arrays(inputs, stacked)["ownership_upside"][:, -1]
+
+        best = int(np.argmax(final_upside))
+        gain = final_upside[best] - baseline_upside
+        row = {
+            "optimal_month": np.nan,
+            "final_ownership_upside": baseline_upside,
+            "upside_gain": gain,
+            "break_even_month": np.nan,
+        }
+        if gain > 0:
+            row["optimal_month"] = months[best]
+            row["final_ownership_upside"] = final_upside[best]
+            row["break_even_month"] = get_break_even_month(checkpoint, sims[best], months[best])
+        rows.append(row)
+
+    return pd.DataFrame(rows, index=pd.Index(list(rates), name="rate"))
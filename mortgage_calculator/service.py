@@ -0,0 +1,458 @@
+"""
+Local simulation service. A small asyncio HTTP server in front of get_all_simulation_data that
+runs the simulations in a process pool.
+
+POST /simulate  JSON object of Inputs fields, unset fields keep their defaults. Responds with
+                the yearly frames as {column: [values]} and the mortgage metrics.
+GET  /stats     Request counts, queue depth and latency percentiles.
+
+Under bursty load many requests carry the same inputs. Requests for inputs that are already
+queued or running are coalesced onto that computation instead of simulating them again.
+Distinct inputs arriving within batch_window seconds of each other are micro batched and
+simulated together by the batched engine in one worker call. While every worker is busy the
+next batch keeps filling up to max_batch_size, so batches grow with the load. Request bodies
+are validated before they are queued. If a batch still fails, its inputs are rerun one at a
+time, so only the requests for the failing inputs get an error.
+
+For backpressure at most max_pending distinct inputs are queued or running at once. Requests
+past that are rejected with a 503 right away rather than queued without bound.
+
+python -m mortgage_calculator.service serve --port 8080
+python -m mortgage_calculator.service loadtest --port 8080 --n-requests 5000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+
+import numpy as np
+
+from mortgage_calculator.calculator import Inputs, DERIVED_FIELDS, EXTRA_PAYMENTS_COMPARISON_COLUMNS, check_input_field
+from mortgage_calculator.cache import get_inputs_key
+from mortgage_calculator.results import SimulationResults, get_simulation_results
+
+
+MAX_BODY_BYTES = 64 * 2**10
+
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class ServiceOverloaded(Exception):
+    """Raised when a request would take the service past its max_pending distinct inputs"""
+
+
+def get_request_inputs(payload) -> Inputs:
+    """
+    Inputs from a request body. Raises a ValueError for unknown or derived fields, values of
+    the wrong type and inputs that are not valid, e.g. a tax year without a tax table.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object of Inputs fields")
+    for name, value in payload.items():
+        check_input_field(name)
+        if Inputs.__dataclass_fields__[name].type is bool:
+            if not isinstance(value, bool):
+                raise ValueError(f"{name} must be true or false, got {value!r}")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{name} must be a finite number, got {value!r}")
+    return Inputs(**payload)
+
+
+def get_inputs_payload(inputs: Inputs) -> dict:
+    """Request body for the inputs, the inverse of get_request_inputs"""
+    return {
+        field.name: getattr(inputs, field.name)
+        for field in fields(inputs)
+        if field.name not in DERIVED_FIELDS
+    }
+
+
+def get_results_payload(results: SimulationResults, i: int) -> dict:
+    """
+    Scenario i in the get_all_simulation_data layout, JSON serializable with the frames as
+    {column: [values]}. Built from the arrays directly, building the frames first would cost
+    more than the simulation.
+    """
+    n_years = int(results.horizon_years[i])
+    year = list(range(n_years))
+    payload = {
+        "yearly_df": {"year": year, **dict(zip(results.yearly_columns, results.yearly[i, :n_years].T.tolist()))},
+        "mortgage_metrics": {name: float(values[i]) for name, values in results.metrics.items()},
+    }
+    if results.has_extra_payments[i]:
+        payload["extra_payments_comparison"] = {
+            "year": year,
+            **dict(zip(EXTRA_PAYMENTS_COMPARISON_COLUMNS, results.extra_payments_comparison[i, :n_years].T.tolist())),
+        }
+    return payload
+
+
+def simulate_batch(inputs_list: list) -> list:
+    """
+    Runs in a worker process. Simulates the inputs as one batch and returns the encoded
+    response body of each, so the event loop only has to write bytes.
+    """
+    results = get_simulation_results(inputs_list)
+    return [json.dumps(get_results_payload(results, i)).encode() for i in range(len(results))]
+
+
+class SimulationService:
+    """
+    Coalesces, micro batches and dispatches simulation requests to an executor. Must be used
+    from a single event loop.
+
+    executor defaults to a ProcessPoolExecutor with max_workers processes. At most max_workers
+    batches run at once.
+    """
+
+    def __init__(
+        self,
+        executor=None,
+        max_workers: int = None,
+        batch_window: float = 0.002,
+        max_batch_size: int = 256,
+        max_pending: int = 4096,
+        latency_window: int = 10000,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._owns_executor = executor is None
+        self._executor = ProcessPoolExecutor(self.max_workers) if executor is None else executor
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+
+        self._in_flight = {} # Inputs key -> future shared by every request for those inputs
+        self._queue = [] # (key, inputs) waiting to be dispatched
+        self._flush_handle = None
+        self._batch_tasks = set() # Referenced until done so they are not garbage collected
+        self._latencies = deque(maxlen=latency_window)
+
+        self.requests = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_inputs = 0
+
+    async def simulate(self, inputs: Inputs) -> bytes:
+        """Encoded get_results_payload of the inputs"""
+        start = time.perf_counter()
+        key = get_inputs_key(inputs)
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            if len(self._in_flight) >= self.max_pending:
+                self.rejected += 1
+                raise ServiceOverloaded(f"{len(self._in_flight)} inputs are already pending")
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            self._enqueue(key, inputs)
+        self.requests += 1
+
+        try:
+            # Shielded so a client going away does not cancel the computation for the others
+            return await asyncio.shield(future)
+        finally:
+            self._latencies.append(time.perf_counter() - start)
+
+    def _enqueue(self, key: str, inputs: Inputs):
+        self._queue.append((key, inputs))
+        if len(self._queue) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+
+    def _flush(self):
+        """Dispatches the queue in batches while there are idle workers"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        while self._queue and len(self._batch_tasks) < self.max_workers:
+            batch = self._queue[:self.max_batch_size]
+            del self._queue[:self.max_batch_size]
+            task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _simulate(self, inputs_list: list) -> list:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, simulate_batch, inputs_list)
+
+    async def _run_batch(self, batch: list):
+        keys = [key for key, _ in batch]
+        inputs_list = [inputs for _, inputs in batch]
+        try:
+            try:
+                results = await self._simulate(inputs_list)
+            except Exception as error:
+                if len(batch) == 1:
+                    results = [error]
+                else:
+                    # One bad input fails its whole batch, rerun them one at a time so only it fails
+                    results = await asyncio.gather(
+                        *(self._simulate([inputs]) for inputs in inputs_list), return_exceptions=True
+                    )
+                    results = [result if isinstance(result, BaseException) else result[0] for result in results]
+
+            for key, result in zip(keys, results):
+                future = self._in_flight.pop(key)
+                if isinstance(result, BaseException):
+                    self.errors += 1
+                    future.set_exception(result)
+                    # Retrieved here so abandoned futures do not log "exception was never retrieved"
+                    future.exception()
+                else:
+                    future.set_result(result)
+        finally:
+            self.batches += 1
+            self.batched_inputs += len(keys)
+            # Whatever queued up while the workers were busy goes out right away
+            self._batch_tasks.discard(asyncio.current_task())
+            if self._queue:
+                self._flush()
+
+    def stats(self) -> dict:
+        """
+        Counters since the start, the current queue depth (inputs waiting for a worker) and
+        pending inputs (queued or running), and latency percentiles in milliseconds over the
+        last latency_window requests.
+        """
+        latencies = 1000 * np.array(self._latencies)
+        percentiles = np.percentile(latencies, [50, 95, 99]) if latencies.size else [np.nan] * 3
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_inputs / self.batches if self.batches else 0.0,
+            "queue_depth": len(self._queue),
+            "pending": len(self._in_flight),
+            "running_batches": len(self._batch_tasks),
+            "latency_ms": {
+                "p50": float(percentiles[0]),
+                "p95": float(percentiles[1]),
+                "p99": float(percentiles[2]),
+                "max": float(latencies.max()) if latencies.size else np.nan,
+            },
+        }
+
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown(cancel_futures=True)
+
+
+########################################################################
+#      HTTP                                                            #
+########################################################################
+
+def _error_body(message: str) -> bytes:
+    return json.dumps({"error": message}).encode()
+
+
+async def handle_request(service: SimulationService, method: str, path: str, body: bytes) -> tuple:
+    """Routes one request, returns (status, response body)"""
+
+    if path == "/stats":
+        if method != "GET":
+            return 405, _error_body("Use GET /stats")
+        return 200, json.dumps(service.stats()).encode()
+
+    if path != "/simulate":
+        return 404, _error_body(f"No route for {path}")
+    if method != "POST":
+        return 405, _error_body("Use POST /simulate")
+
+    try:
+        inputs = get_request_inputs(json.loads(body or b"{}"))
+    except (ValueError, TypeError) as error:
+        return 400, _error_body(str(error))
+
+    try:
+        return 200, await service.simulate(inputs)
+    except ServiceOverloaded as error:
+        return 503, _error_body(str(error))
+    except Exception as error:
+        return 500, _error_body(f"{type(error).__name__}: {error}")
+
+
+def _encode_response(status: int, body: bytes, keep_alive: bool) -> bytes:
+    head = (
+        f"HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+async def handle_connection(service: SimulationService, reader, writer):
+    """Serves HTTP/1.1 requests on one connection, kept alive until the client closes it"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, path = request_line.decode("latin-1").split()[:2]
+
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            keep_alive = headers.get("connection", "").lower() != "close"
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                writer.write(_encode_response(413, _error_body(f"Body over {MAX_BODY_BYTES} bytes"), False))
+                await writer.drain()
+                break
+
+            status, body = await handle_request(service, method, path, await reader.readexactly(length))
+            writer.write(_encode_response(status, body, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8080, **service_kwargs):
+    """Runs the service until cancelled"""
+    service = SimulationService(**service_kwargs)
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer), host, port
+    )
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+########################################################################
+#      Load test                                                       #
+########################################################################
+
+async def _post(reader, writer, path: str, body: bytes) -> tuple:
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def run_load_test(
+    host: str,
+    port: int,
+    payloads: list,
+    n_requests: int,
+    concurrency: int = 64,
+    seed: int = 0,
+) -> dict:
+    """
+    Sends n_requests POST /simulate requests over concurrency keep alive connections, each with
+    a payload drawn at random from payloads, so fewer distinct payloads means more coalescing.
+    Returns the throughput, client side latency percentiles in milliseconds and status counts.
+    """
+
+    rng = np.random.default_rng(seed)
+    bodies = [json.dumps(payload).encode() for payload in payloads]
+    order = rng.integers(len(bodies), size=n_requests)
+    next_request = iter(range(n_requests))
+    latencies = []
+    statuses = {}
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for i in next_request:
+                start = time.perf_counter()
+                status, _ = await _post(reader, writer, "/simulate", bodies[order[i]])
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(1000 * np.array(latencies), [50, 95, 99])
+    return {
+        "requests": n_requests,
+        "seconds": seconds,
+        "requests_per_second": n_requests / seconds,
+        "latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+        "statuses": statuses,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local simulation service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the service")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--workers", type=int, default=None, help="Worker processes, the CPU count by default")
+    serve_parser.add_argument("--batch-window", type=float, default=0.002, help="Seconds to collect a micro batch")
+    serve_parser.add_argument("--max-batch-size", type=int, default=256)
+    serve_parser.add_argument("--max-pending", type=int, default=4096, help="Distinct inputs queued or running before 503s")
+
+    load_parser = subparsers.add_parser("loadtest", help="Load test a running service")
+    load_parser.add_argument("--host", default="127.0.0.1")
+    load_parser.add_argument("--port", type=int, default=8080)
+    load_parser.add_argument("--n-requests", type=int, default=5000)
+    load_parser.add_argument("--concurrency", type=int, default=64)
+    load_parser.add_argument("--n-distinct", type=int, default=500, help="Distinct inputs the requests draw from")
+    load_parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        print(f"Serving on http://{args.host}:{args.port}")
+        try:
+            asyncio.run(serve(
+                args.host,
+                args.port,
+                max_workers=args.workers,
+                batch_window=args.batch_window,
+                max_batch_size=args.max_batch_size,
+                max_pending=args.max_pending,
+            ))
+        except KeyboardInterrupt:
+            pass
+    else:
+        from mortgage_calculator.benchmark import get_random_inputs
+
+        payloads = [get_inputs_payload(inputs) for inputs in get_random_inputs(args.n_distinct, args.seed)]
+        results = asyncio.run(run_load_test(args.host, args.port, payloads, args.n_requests, args.concurrency, args.seed))
+        print(json.dumps(results, indent=2, default=float))
+
+
+if __name__ == "__main__":
+    main()
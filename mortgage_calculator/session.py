@@ -0,0 +1,184 @@
+"""
+Interactive simulation session. Holds the last Inputs together with every intermediate result
+of the simulation, and when a field changes only recomputes the stages that depend on it.
+
+The dependencies are declared in STAGES: each stage lists the input fields it reads, the
+stages it builds on and the monthly columns it produces. Changing mo_rent_comparison_exp for
+example only reruns the rent stream, the rent portfolio and the yearly metrics, which keeps
+slider updates well under a millisecond of simulation work.
+"""
+
+from dataclasses import replace
+from typing import TYPE_CHECKING
+
+from mortgage_calculator.calculator import (
+    Inputs,
+    HOME_SCHEDULE_FIELDS,
+    check_input_field,
+    get_home_schedule,
+    get_inputs_loan_schedule,
+    get_pmi_schedule,
+    get_ownership_columns,
+    get_portfolio_columns,
+    get_yearly_steps,
+    get_yearly_column_aggs,
+    add_yearly_metrics,
+    get_extra_payments_comparison_arrays,
+    get_mortgage_metrics,
+    yearly_arrays_to_df,
+)
+from mortgage_calculator.tax import TAX_FIELDS
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Fields that feed the derived loan_amount and mo_amortized
+LOAN_FIELDS = ["home_price", "down_payment", "interest_rate", "loan_term_years"]
+
+# Fields that feed the derived cash_outlay
+CASH_OUTLAY_FIELDS = ["home_price", "closing_costs_rate", "down_payment", "rehab"]
+
+# stage: (input fields, upstream stages, monthly columns produced), in topological order
+STAGES = {
+    "home": (
+        HOME_SCHEDULE_FIELDS,
+        [],
+        ["home_value", "property_tax_exp", "insurance_exp", "maintenance_exp", "hoa_exp", "utility_exp"],
+    ),
+    "loan": (
+        LOAN_FIELDS + ["mo_extra_payment", "num_extra_payments", "horizon_years"],
+        [],
+        ["interest_exp", "principal_exp", "extra_payments_exp", "loan_balance"],
+    ),
+    "baseline_loan": (
+        LOAN_FIELDS + ["horizon_years"],
+        [],
+        [],
+    ),
+    "ownership": (
+        ["home_price", "down_payment", "pmi_rate"],
+        ["home", "loan"],
+        ["pmi_exp", "ownership_exp", "total_exp"],
+    ),
+    "rent_comparison_exp": (
+        ["mo_rent_comparison_exp", "yr_rent_increase", "horizon_years"],
+        [],
+        ["rent_comparison_exp"],
+    ),
+    "rent_comparison_portfolio": (
+        CASH_OUTLAY_FIELDS + ["rent_surplus_portfolio_growth"],
+        ["ownership", "rent_comparison_exp"],
+        ["rent_comparison_portfolio"],
+    ),
+    "extra_payments_portfolio": (
+        ["extra_payments_portfolio_growth"],
+        ["loan"],
+        ["extra_payments_portfolio"],
+    ),
+    "yearly": (
+        CASH_OUTLAY_FIELDS + TAX_FIELDS + ["realtor_rate", "capital_gains_tax_rate", "mo_extra_payment", "num_extra_payments"],
+        ["home", "loan", "baseline_loan", "ownership", "rent_comparison_exp", "rent_comparison_portfolio", "extra_payments_portfolio"],
+        [],
+    ),
+}
+
+
+def get_dirty_stages(changed_fields) -> list:
+    """Stages that read any of the changed fields, plus everything downstream of them"""
+    changed_fields = set(changed_fields)
+    dirty = []
+    for stage, (fields, upstream, _) in STAGES.items():
+        if changed_fields.intersection(fields) or any(name in dirty for name in upstream):
+            dirty.append(stage)
+    return dirty
+
+
+class SimulationSession:
+    """
+    Stateful simulation for interactive use.
+
+    session = SimulationSession(Inputs())
+    yearly_df = session.update(mo_rent_comparison_exp=1800)
+
+    Results always match get_all_simulation_data for the current inputs.
+    """
+
+    def __init__(self, inputs: Inputs):
+        self.inputs = replace(inputs)
+        self.monthly = {}
+        self.yearly = {}
+        self._home = None
+        self._loan = None
+        self._baseline_loan = None
+        self._yearly_df = None
+        self._run(list(STAGES), set(sum((columns for _, _, columns in STAGES.values()), [])))
+
+    def update(self, **changes) -> "pd.DataFrame":
+        """Set new values for some input fields and return the updated yearly_df"""
+
+        for name in changes:
+            check_input_field(name)
+        changed = [name for name, value in changes.items() if getattr(self.inputs, name) != value]
+        if not changed:
+            return self.yearly_df
+
+        # replace reruns __post_init__, so the derived fields stay consistent
+        self.inputs = replace(self.inputs, **changes)
+
+        dirty = get_dirty_stages(changed)
+        self._run(dirty, set(sum((STAGES[stage][2] for stage in dirty), [])))
+        return self.yearly_df
+
+    @property
+    def yearly_df(self) -> "pd.DataFrame":
+        if self._yearly_df is None:
+            self._yearly_df = yearly_arrays_to_df(self.yearly)
+        return self._yearly_df
+
+    @property
+    def results(self) -> dict:
+        """Current results in the get_all_simulation_data format"""
+        results = {
+            "yearly_df": self.yearly_df,
+            "mortgage_metrics": get_mortgage_metrics(self.yearly),
+        }
+        if self.inputs.mo_extra_payment and self.inputs.num_extra_payments:
+            yearly_no_extra = {"interest_exp_sum": self._baseline_loan["interest_exp"].reshape(-1, 12).sum(axis=-1)}
+            results["extra_payments_comparison"] = yearly_arrays_to_df(
+                get_extra_payments_comparison_arrays(self.yearly, yearly_no_extra)
+            )
+        return results
+
+    def _run(self, stages: list, dirty_columns: set):
+        inputs = self.inputs
+        monthly = self.monthly
+
+        if "home" in stages:
+            self._home = get_home_schedule(inputs)
+            monthly.update({col: self._home[col] for col in STAGES["home"][2]})
+
+        if "loan" in stages:
+            self._loan = get_inputs_loan_schedule(inputs, extra_payments=True)
+            monthly.update(self._loan)
+
+        if "baseline_loan" in stages:
+            self._baseline_loan = get_inputs_loan_schedule(inputs, extra_payments=False)
+
+        if "ownership" in stages:
+            monthly["pmi_exp"] = get_pmi_schedule(inputs, self._home["start_home_value"], monthly["loan_balance"])
+            monthly.update(get_ownership_columns(monthly))
+
+        if "rent_comparison_exp" in stages:
+            monthly["rent_comparison_exp"] = get_yearly_steps(inputs.mo_rent_comparison_exp, inputs.yr_rent_increase, inputs.horizon_years)
+
+        for portfolio in ["rent_comparison_portfolio", "extra_payments_portfolio"]:
+            if portfolio in stages:
+                monthly.update(get_portfolio_columns(inputs, monthly, columns=[portfolio]))
+
+        if "yearly" in stages:
+            # Only reaggregate the monthly columns that changed, keys keep their column order
+            self.yearly.update(get_yearly_column_aggs(monthly, dirty_columns))
+            add_yearly_metrics(inputs, self.yearly)
+            self._yearly_df = None
@@ -0,0 +1,119 @@
+"""
+Break even solver. Finds the value of a single Inputs field at which owning and renting come out
+even, i.e. ownership_upside crosses zero, in a target year. For example the rent at which a home
+pays off after 7 years, or the down payment needed to beat renting within 10 years.
+
+The root is found with a bracketing false position search (Illinois variant) that is vectorized
+across homes, so many homes are solved at once. Every evaluation only simulates the months up
+to the end of the target year.
+"""
+
+from dataclasses import replace
+
+import numpy as np
+
+from mortgage_calculator.calculator import Inputs, check_input_field, get_yearly_agg_arrays
+from mortgage_calculator.batch import get_batch_monthly_sim, stack_inputs
+
+
+def get_ownership_upside_at_year(inputs_list, field: str, values: np.ndarray, target_year: int) -> np.ndarray:
+    """ownership_upside in the target year for every home with field set to the matching value"""
+
+    inputs_list = [replace(inputs, **{field: value}) for inputs, value in zip(inputs_list, values)]
+    monthly = get_batch_monthly_sim(inputs_list, extra_payments=True, n_months=12 * (target_year + 1))
+    yearly = get_yearly_agg_arrays(stack_inputs(inputs_list), monthly)
+    return yearly["ownership_upside"][:, target_year]
+
+
+def solve_break_even_batch(
+    inputs_list,
+    field: str,
+    target_year: int,
+    lower,
+    upper,
+    xtol: float = 1e-6,
+    ftol: float = 1e-2,
+    max_iter: int = 100,
+) -> np.ndarray:
+    """
+    Solves for the value of field in [lower, upper] that makes ownership_upside zero in the
+    target year, for every home in inputs_list. lower and upper can be single values or one per
+    home. Homes where ownership_upside does not change sign over the bracket get NaN.
+
+    Stops once the bracket is narrower than xtol or ownership_upside is within ftol dollars of 0.
+    """
+
+    check_input_field(field)
+    inputs_list = list(inputs_list)
+    if field in ["loan_term_years", "horizon_years"]:
+        raise ValueError(f"{field} only takes whole numbers of years and can not be solved for")
+    if not all(0 <= target_year < inputs.horizon_years for inputs in inputs_list):
+        raise ValueError("target_year must be within the horizon of every home")
+    n = len(inputs_list)
+    lower = np.broadcast_to(np.asarray(lower, dtype=float), (n,)).copy()
+    upper = np.broadcast_to(np.asarray(upper, dtype=float), (n,)).copy()
+
+    f_lower = get_ownership_upside_at_year(inputs_list, field, lower, target_year)
+    f_upper = get_ownership_upside_at_year(inputs_list, field, upper, target_year)
+
+    root = np.full(n, np.nan)
+    root[f_lower == 0] = lower[f_lower == 0]
+    root[f_upper == 0] = upper[f_upper == 0]
+    active = (np.sign(f_lower) * np.sign(f_upper) < 0) & np.isnan(root)
+
+    # Which end of the bracket was kept on the last step, to halve its value when it repeats
+    last_kept = np.zeros(n)
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+
+        idx = np.flatnonzero(active)
+        a, b, fa, fb = lower[idx], upper[idx], f_lower[idx], f_upper[idx]
+
+        guess = b - fb * (b - a) / (fb - fa)
+        # Fall back to bisection if the secant leaves the bracket
+        outside = ~((guess > np.minimum(a, b)) & (guess < np.maximum(a, b)))
+        guess[outside] = (a[outside] + b[outside]) / 2
+
+        f_guess = get_ownership_upside_at_year([inputs_list[i] for i in idx], field, guess, target_year)
+
+        replace_lower = np.sign(f_guess) == np.sign(fa)
+        lower[idx] = np.where(replace_lower, guess, a)
+        f_lower[idx] = np.where(replace_lower, f_guess, fa)
+        upper[idx] = np.where(replace_lower, b, guess)
+        f_upper[idx] = np.where(replace_lower, fb, f_guess)
+
+        # Illinois step: halve the value at the end that stayed put twice in a row
+        kept = np.where(replace_lower, 1.0, -1.0)
+        stuck = kept == last_kept[idx]
+        f_upper[idx] = np.where(stuck & replace_lower, f_upper[idx] / 2, f_upper[idx])
+        f_lower[idx] = np.where(stuck & ~replace_lower, f_lower[idx] / 2, f_lower[idx])
+        last_kept[idx] = kept
+
+        done = (np.abs(f_guess) <= ftol) | (np.abs(upper[idx] - lower[idx]) <= xtol)
+        root[idx[done]] = guess[done]
+        active[idx[done]] = False
+
+    # Anything left after max_iter is reported at its last bracket midpoint
+    root[active] = (lower[active] + upper[active]) / 2
+    return root
+
+
+def solve_break_even(
+    inputs: Inputs,
+    field: str,
+    target_year: int,
+    lower: float,
+    upper: float,
+    xtol: float = 1e-6,
+    ftol: float = 1e-2,
+    max_iter: int = 100,
+) -> float:
+    """
+    Value of field in [lower, upper] at which ownership_upside is zero in the target year,
+    or NaN if there is no sign change over the bracket.
+
+    solve_break_even(inputs, "mo_rent_comparison_exp", target_year=7, lower=500, upper=5000)
+    """
+    return float(solve_break_even_batch([inputs], field, target_year, lower, upper, xtol, ftol, max_iter)[0])
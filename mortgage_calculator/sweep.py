@@ -0,0 +1,113 @@
+"""
+Parameter sweeps. Evaluates a grid of Inputs built from ranges of field values on top of a base
+Inputs, e.g. down_payment x interest_rate x mo_extra_payment x num_extra_payments.
+
+The grid is split into chunks and every chunk runs through the batched engine, either inline
+or across a process pool. Results come back in grid order, so the output does not depend on
+the number of workers.
+"""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import TYPE_CHECKING, Iterator
+
+import numpy as np
+
+from mortgage_calculator.calculator import Inputs, check_input_field, get_break_even_year
+from mortgage_calculator.batch import get_batch_simulation_arrays, get_batch_mortgage_metrics, get_final_year_values
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def get_sweep_grid(ranges: dict) -> list:
+    """
+    Cartesian product of the ranges as a list of field overrides, in the order the ranges were
+    given with the last field varying fastest.
+    """
+
+    for name in ranges:
+        check_input_field(name)
+
+    names = list(ranges)
+    return [dict(zip(names, values)) for values in itertools.product(*ranges.values())]
+
+
+def get_sweep_metrics(base: Inputs, points: list) -> dict:
+    """
+    Summary metrics for every grid point: the get_mortgage_metrics values, the final
+    ownership_upside (in the horizon year) and the break even year. Returns one array per metric.
+    """
+
+    arrays = get_batch_simulation_arrays([replace(base, **point) for point in points])
+    yearly = arrays["yearly"]
+
+    metrics = get_batch_mortgage_metrics(yearly)
+    metrics["Final Ownership Upside"] = get_final_year_values(yearly["ownership_upside"], arrays["horizon_years"])
+    metrics["Break Even Year"] = get_break_even_year(yearly["ownership_upside"])
+    return metrics
+
+
+def _get_chunk_df(base: Inputs, points: list, first_point: int) -> "pd.DataFrame":
+    """Long format results of one chunk, one row per grid point and metric"""
+
+    import pandas as pd
+
+    metrics = get_sweep_metrics(base, points)
+    point_ids = np.arange(first_point, first_point + len(points))
+
+    wide_df = pd.DataFrame(points, index=pd.Index(point_ids, name="point"))
+    for name, values in metrics.items():
+        wide_df[name] = values
+
+    return (
+        wide_df
+        .reset_index()
+        .melt(id_vars=["point", *points[0]], value_vars=list(metrics), var_name="metric")
+        .sort_values("point", kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def iter_sweep(
+    base: Inputs,
+    ranges: dict,
+    n_workers: int = 1,
+    chunk_size: int = 256,
+) -> Iterator["pd.DataFrame"]:
+    """
+    Streams the sweep results one chunk at a time, in grid order. With n_workers > 1 the chunks
+    are evaluated in a process pool, otherwise in this process.
+    """
+
+    grid = get_sweep_grid(ranges)
+    starts = list(range(0, len(grid), chunk_size))
+    chunks = [grid[start:start + chunk_size] for start in starts]
+
+    if n_workers <= 1:
+        for start, chunk in zip(starts, chunks):
+            yield _get_chunk_df(base, chunk, start)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        # map keeps the submission order no matter which worker finishes first
+        yield from executor.map(_get_chunk_df, itertools.repeat(base), chunks, starts)
+
+
+def run_sweep(
+    base: Inputs,
+    ranges: dict,
+    n_workers: int = 1,
+    chunk_size: int = 256,
+) -> "pd.DataFrame":
+    """
+    Evaluates every combination of the ranges on top of the base inputs. Returns a tidy long
+    format table with columns point, one column per swept field, metric and value.
+
+    run_sweep(Inputs(), {"down_payment": [20000, 50000], "interest_rate": [0.05, 0.065]})
+    """
+    import pandas as pd
+
+    return pd.concat(list(iter_sweep(base, ranges, n_workers, chunk_size)), ignore_index=True)
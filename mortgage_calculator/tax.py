@@ -0,0 +1,260 @@
+"""
+Taxes of owning versus renting, computed for every year of every scenario at once.
+
+With use_tax_model off, every gain is taxed at the flat capital_gains_tax_rate and there are
+no deductions, as in the original simulation. With it on, for each year:
+
+- The owner itemizes when mortgage interest plus state and local taxes beat the standard
+  deduction. Interest only counts on the share of the loan under the mortgage debt limit, and
+  property tax plus state income tax count up to the SALT cap. The renter takes the larger of
+  the standard deduction and their capped state income tax. The income tax saved by owning is
+  the difference of the two bracketed income taxes.
+- Selling the home at the end of the year is taxed at the bracketed long term capital gains
+  rates, stacked on top of that year's taxable income. The gain is the sale price less the
+  realtor fee and the cost basis. A primary residence owned for at least 2 years excludes up
+  to the home sale exclusion, and a loss is not deductible.
+- The rent portfolio gains are taxed the same way on top of the renter's taxable income.
+
+Household income, the standard deduction and the bracket thresholds grow with
+yr_inflation_rate. The SALT cap, mortgage debt limit and home sale exclusion are fixed in
+nominal dollars, as they are in the tax code.
+
+Tax tables are keyed by tax year. The bundled years are read from tax_tables/<year>.json the
+first time they are used. Others can be added with register_tax_table, e.g. from a JSON file
+loaded with load_tax_table. All amounts are (single, married filing jointly) pairs.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+
+TAX_TABLE_DIR = os.path.join(os.path.dirname(__file__), "tax_tables")
+
+# Inputs fields read by the tax model
+TAX_FIELDS = [
+    "use_tax_model",
+    "yr_household_income",
+    "married_filing_jointly",
+    "state_income_tax_rate",
+    "primary_residence",
+    "tax_year",
+]
+
+
+@dataclass(frozen=True)
+class TaxTable:
+    year: int
+    standard_deduction: tuple
+    salt_cap: tuple
+    mortgage_debt_limit: tuple # Interest on the part of the loan above this is not deductible
+    home_sale_exclusion: tuple
+    income_thresholds: tuple # Lower bound of every bracket, one tuple per filing status
+    income_rates: tuple
+    ltcg_thresholds: tuple
+    ltcg_rates: tuple
+    # The SALT cap shrinks by salt_phaseout_rate of the income above salt_phaseout_income, down
+    # to salt_cap_floor. No phase out when left out.
+    salt_cap_floor: tuple = None
+    salt_phaseout_income: tuple = None
+    salt_phaseout_rate: float = 0
+
+
+_registered_tables = {}
+
+
+def load_tax_table(path: str) -> TaxTable:
+    """Reads a TaxTable from a JSON file with the TaxTable fields, see tax_tables/ for examples"""
+    with open(path) as f:
+        values = json.load(f)
+    return TaxTable(**{
+        name: tuple(tuple(x) if isinstance(x, list) else x for x in value) if isinstance(value, list) else value
+        for name, value in values.items()
+    })
+
+
+def register_tax_table(table: TaxTable):
+    """Makes table the tax table of table.year, replacing a bundled table of that year"""
+    _registered_tables[table.year] = table
+    _get_stacked_tables.cache_clear()
+
+
+def unregister_tax_table(year: int):
+    """Removes the table registered for year, a bundled table of that year is used again"""
+    _registered_tables.pop(int(year), None)
+    _get_stacked_tables.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _load_bundled_tax_table(year: int) -> TaxTable:
+    path = os.path.join(TAX_TABLE_DIR, f"{year}.json")
+    if not os.path.exists(path):
+        raise ValueError(f"No tax table for {year}, add one with register_tax_table")
+    return load_tax_table(path)
+
+
+def get_tax_table(year: int) -> TaxTable:
+    year = int(year)
+    if year in _registered_tables:
+        return _registered_tables[year]
+    return _load_bundled_tax_table(year)
+
+
+def _get_table_arrays(table: TaxTable, n_income_brackets: int, n_ltcg_brackets: int) -> dict:
+    """
+    Arrays of shape (2,) per amount and (2, n_brackets) per bracket schedule. Brackets are
+    padded to n_brackets with brackets that start at infinity, and rates are turned into the
+    marginal rate steps get_bracket_tax works with.
+    """
+
+    def get_brackets(thresholds, rates, n_brackets):
+        thresholds = np.array(thresholds, dtype=float)
+        steps = np.diff(np.array(rates, dtype=float), prepend=0)
+        padding = n_brackets - len(steps)
+        thresholds = np.pad(thresholds, ((0, 0), (0, padding)), constant_values=np.inf)
+        steps = np.broadcast_to(np.pad(steps, (0, padding)), thresholds.shape)
+        return thresholds, steps
+
+    income_thresholds, income_steps = get_brackets(table.income_thresholds, table.income_rates, n_income_brackets)
+    ltcg_thresholds, ltcg_steps = get_brackets(table.ltcg_thresholds, table.ltcg_rates, n_ltcg_brackets)
+    salt_cap = np.array(table.salt_cap, dtype=float)
+
+    return {
+        "standard_deduction": np.array(table.standard_deduction, dtype=float),
+        "salt_cap": salt_cap,
+        "salt_cap_floor": salt_cap if table.salt_cap_floor is None else np.array(table.salt_cap_floor, dtype=float),
+        "salt_phaseout_income": np.array(
+            (np.inf, np.inf) if table.salt_phaseout_income is None else table.salt_phaseout_income, dtype=float
+        ),
+        "salt_phaseout_rate": np.full(2, table.salt_phaseout_rate, dtype=float),
+        "mortgage_debt_limit": np.array(table.mortgage_debt_limit, dtype=float),
+        "home_sale_exclusion": np.array(table.home_sale_exclusion, dtype=float),
+        "income_thresholds": income_thresholds,
+        "income_steps": income_steps,
+        "ltcg_thresholds": ltcg_thresholds,
+        "ltcg_steps": ltcg_steps,
+    }
+
+
+@lru_cache(maxsize=64)
+def _get_stacked_tables(years: tuple) -> dict:
+    """Arrays of the tables of years stacked along a new first axis, built once per set of years"""
+    tables = [get_tax_table(year) for year in years]
+    n_income_brackets = max(len(table.income_rates) for table in tables)
+    n_ltcg_brackets = max(len(table.ltcg_rates) for table in tables)
+    arrays = [_get_table_arrays(table, n_income_brackets, n_ltcg_brackets) for table in tables]
+    return {name: np.stack([values[name] for values in arrays]) for name in arrays[0]}
+
+
+def get_tax_params(tax_year, married_filing_jointly) -> dict:
+    """
+    Tax table values of every scenario. tax_year and married_filing_jointly are scalars or
+    arrays such as the (n_scenarios, 1) columns of stack_inputs. Amounts come out in their
+    shape, bracket schedules with an extra trailing bracket axis.
+    """
+    years = np.asarray(tax_year).astype(int)
+    status = np.asarray(married_filing_jointly).astype(int)
+    unique_years, table_index = np.unique(years, return_inverse=True)
+    stacked = _get_stacked_tables(tuple(unique_years.tolist()))
+    table_index = table_index.reshape(years.shape)
+    return {name: values[table_index, status] for name, values in stacked.items()}
+
+
+def get_bracket_tax(income, thresholds, steps):
+    """
+    Tax of income under brackets starting at thresholds, where steps are the increases of the
+    marginal rate at each threshold. income has shape (...), thresholds and steps (..., n_brackets).
+    """
+    return (np.maximum(0, np.asarray(income)[..., None] - thresholds) * steps).sum(axis=-1)
+
+
+def get_gains_tax(taxable_income, gains, thresholds, steps):
+    """Long term capital gains tax of gains stacked on top of the ordinary taxable income"""
+    return get_bracket_tax(taxable_income + gains, thresholds, steps) - get_bracket_tax(taxable_income, thresholds, steps)
+
+
+def get_yearly_taxes(inputs, year) -> dict:
+    """
+    Yearly tax columns from the yearly aggregates in year, a dict of (..., n_years) arrays or
+    the yearly frame. inputs can be an Inputs or stacked inputs, as for add_yearly_metrics.
+
+    Returns
+    - home_sale_tax: capital gains tax if the home is sold at the end of the year
+    - rent_portfolio_tax: capital gains tax if the rent portfolio is sold at the end of the year
+    - tax_savings: income tax saved by owning in the year, zero without the tax model
+    """
+
+    home_value = np.asarray(year["home_value_max"], dtype=float)
+    interest = np.asarray(year["interest_exp_sum"], dtype=float)
+    property_tax = np.asarray(year["property_tax_exp_sum"], dtype=float)
+    portfolio = np.asarray(year["rent_comparison_portfolio_max"], dtype=float)
+    additional_investment = (
+        np.cumsum(np.asarray(year["total_exp_sum"], dtype=float), axis=-1) -
+        np.cumsum(np.asarray(year["rent_comparison_exp_sum"], dtype=float), axis=-1)
+    )
+    cost_basis = inputs.home_price + inputs.rehab
+
+    # Flat rate, the rent portfolio is taxed on what was put into it like the original model
+    taxes = {
+        "home_sale_tax": (home_value - cost_basis) * inputs.capital_gains_tax_rate,
+        "rent_portfolio_tax": (inputs.cash_outlay + additional_investment) * inputs.capital_gains_tax_rate,
+        "tax_savings": np.zeros(np.broadcast_shapes(home_value.shape, np.shape(inputs.use_tax_model))),
+    }
+    use_tax_model = np.asarray(inputs.use_tax_model).astype(bool)
+    if not use_tax_model.any():
+        return taxes
+
+    # Rows without the tax model can name a year without a table, give them a year that has one
+    tax_year, taxed = np.broadcast_arrays(np.asarray(inputs.tax_year), use_tax_model)
+    tax_year = np.where(taxed, tax_year, tax_year[taxed][0])
+    params = get_tax_params(tax_year, inputs.married_filing_jointly)
+    n_years = home_value.shape[-1]
+    index = (1 + np.asarray(inputs.yr_inflation_rate)) ** np.arange(n_years)
+
+    ########################################################################
+    #      Income tax saved by itemizing                                   #
+    ########################################################################
+
+    income = inputs.yr_household_income * index
+    state_income_tax = income * inputs.state_income_tax_rate
+    salt_cap = np.maximum(
+        params["salt_cap_floor"],
+        params["salt_cap"] - params["salt_phaseout_rate"] * np.maximum(0, income - params["salt_phaseout_income"])
+    )
+    deductible_share = np.minimum(1, params["mortgage_debt_limit"] / np.maximum(inputs.loan_amount, 1))
+
+    standard_deduction = params["standard_deduction"] * index
+    renter_deduction = np.maximum(standard_deduction, np.minimum(state_income_tax, salt_cap))
+    owner_deduction = np.maximum(
+        standard_deduction,
+        interest * deductible_share + np.minimum(state_income_tax + property_tax, salt_cap)
+    )
+    renter_taxable_income = np.maximum(0, income - renter_deduction)
+    owner_taxable_income = np.maximum(0, income - owner_deduction)
+
+    income_thresholds = params["income_thresholds"] * index[..., None]
+    tax_savings = (
+        get_bracket_tax(renter_taxable_income, income_thresholds, params["income_steps"]) -
+        get_bracket_tax(owner_taxable_income, income_thresholds, params["income_steps"])
+    )
+
+    ########################################################################
+    #      Capital gains on a sale at the end of the year                  #
+    ########################################################################
+
+    years_owned = np.arange(1, n_years + 1)
+    exclusion = params["home_sale_exclusion"] * (np.asarray(inputs.primary_residence).astype(bool) & (years_owned >= 2))
+    home_gains = np.maximum(0, home_value * (1 - inputs.realtor_rate) - cost_basis - exclusion)
+    rent_gains = np.maximum(0, portfolio - inputs.cash_outlay - additional_investment)
+
+    ltcg_thresholds = params["ltcg_thresholds"] * index[..., None]
+    home_sale_tax = get_gains_tax(owner_taxable_income, home_gains, ltcg_thresholds, params["ltcg_steps"])
+    rent_portfolio_tax = get_gains_tax(renter_taxable_income, rent_gains, ltcg_thresholds, params["ltcg_steps"])
+
+    taxes["home_sale_tax"] = np.where(use_tax_model, home_sale_tax, taxes["home_sale_tax"])
+    taxes["rent_portfolio_tax"] = np.where(use_tax_model, rent_portfolio_tax, taxes["rent_portfolio_tax"])
+    taxes["tax_savings"] = np.where(use_tax_model, tax_savings, taxes["tax_savings"])
+    return taxes
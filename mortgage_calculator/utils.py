@@ -1,5 +1,8 @@
 """Financial calculations helper functions"""
 
+import numpy as np
+
+
 def get_amortization_payment(loan_amount, interest_rate, years=30):
     monthly_rate = interest_rate / 12
     n_payments = years * 12
@@ -8,6 +11,13 @@ def get_amortization_payment(loan_amount, interest_rate, years=30):
     return monthly_payment
 
 
+def get_amortization_balance(loan_amount, interest_rate, monthly_payment, months):
+    """Remaining loan balance after a number of monthly payments. Works elementwise on arrays."""
+    monthly_rate = interest_rate / 12
+    compounding = (1 + monthly_rate)**months
+    return loan_amount * compounding - monthly_payment * (compounding - 1) / monthly_rate
+
+
 def add_growth(value, yearly_growth_rate, months, monthly_contribution=0):
     """Calculate the value of an asset after a number of months"""
 
@@ -49,3 +59,13 @@ def get_monthly_pmi(home_value, loan_balance, pmi_rate, init_home_value):
         return 0
     else:
         return (loan_balance * pmi_rate) / 12
+
+
+def get_monthly_pmi_array(home_value, loan_balance, pmi_rate, init_home_value):
+    """
+    Elementwise version of get_monthly_pmi for numpy arrays. Used by the vectorized
+    simulation engines where every argument may be an array of scenarios or months.
+    """
+    cancel = cancel_pmi_from_equity(home_value, loan_balance) | \
+        cancel_pmi_from_loan_balance(init_home_value, loan_balance)
+    return np.where(cancel, 0.0, (loan_balance * pmi_rate) / 12)
@@ -1,6 +1,70 @@
+import asyncio
+import io
+import json
+import pickle
+import tempfile
 import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 
-from mortgage_calculator.utils import *
+import numpy as np
+import pandas as pd
+
+from mortgage_calculator.utils import (
+    get_amortization_payment,
+    add_growth,
+    cancel_pmi_from_equity,
+    cancel_pmi_from_loan_balance,
+    get_monthly_pmi,
+)
+from mortgage_calculator.calculator import (
+    Inputs,
+    MortgageInputs,
+    ExpensesInputs,
+    TaxInputs,
+    get_all_simulation_data,
+    get_monthly_sim,
+    get_monthly_sim_df,
+    get_yearly_agg_df,
+    get_yearly_agg_arrays,
+    get_monthly_sim_loop,
+    get_loan_schedule,
+    get_home_schedule,
+    assemble_monthly_sim,
+    MONTHLY_COLUMNS,
+)
+from mortgage_calculator.batch import get_batch_simulation_data
+from mortgage_calculator.sweep import run_sweep
+from mortgage_calculator.solver import solve_break_even, solve_break_even_batch
+from mortgage_calculator.cache import CACHE_VERSION, SimulationCache, StageCache, get_inputs_key, get_results_nbytes
+from mortgage_calculator.session import SimulationSession, get_dirty_stages
+from mortgage_calculator.listings import evaluate_listings, evaluate_listings_chunk, main as listings_main
+from mortgage_calculator.benchmark import IMPORT_BUDGETS, check_equivalence, compare_results, measure_cold_start, get_random_inputs, run_benchmark
+from mortgage_calculator.profiling import profile_stages, is_profiling
+from mortgage_calculator.refinance import Refinance, get_refinance_checkpoint, get_refinance_monthly_sim, get_refinanced_loan_schedule, get_optimal_refinance
+from mortgage_calculator.results import get_simulation_results
+from mortgage_calculator.portfolio import Property, EquityDraw, simulate_portfolio
+from mortgage_calculator.service import SimulationService, ServiceOverloaded, handle_request, get_inputs_payload, simulate_batch
+from mortgage_calculator.tax import get_tax_table, register_tax_table, unregister_tax_table, get_tax_params, get_bracket_tax, get_yearly_taxes
+from mortgage_calculator.core import get_simulation_arrays, get_simulation_summary, main as core_main
+from mortgage_calculator.monte_carlo import (
+    LognormalModel,
+    BootstrapModel,
+    get_monte_carlo_yearly_arrays,
+    get_monte_carlo_simulation_data,
+)
+
+
+# Scenarios that exercise PMI cancellation, extra payment clamping and paying off the loan early
+SCENARIOS = [
+    dict(),
+    dict(mo_extra_payment=0, num_extra_payments=0),
+    dict(down_payment=15000, pmi_rate=0.01, yr_home_appreciation=0.0),
+    dict(down_payment=20000, mo_extra_payment=5000, num_extra_payments=360, mo_hoa_fees=150),
+    dict(home_price=600000, down_payment=60000, yr_home_appreciation=-0.02, mo_rent_comparison_exp=4000),
+]
 
 class TestFinancialFunctions(unittest.TestCase):
 
@@ -86,5 +150,737 @@ class TestFinancialFunctions(unittest.TestCase):
         self.assertAlmostEqual(asset_value, 101.407, places=2)
 
 
+class TestStagedSimulation(unittest.TestCase):
+
+    def test_staged_matches_loop(self):
+        for kwargs in SCENARIOS:
+            inputs = Inputs(**kwargs)
+            for extra_payments in [False, True]:
+                pd.testing.assert_frame_equal(
+                    get_monthly_sim_loop(inputs, extra_payments).to_df(),
+                    get_monthly_sim_df(inputs, extra_payments),
+                    check_dtype=False,
+                    atol=1e-6
+                )
+
+    def test_loan_schedule_pays_off_early(self):
+        loan = get_loan_schedule(100000, 0.06, get_amortization_payment(100000, 0.06), 2000, 360, clamp_payoff=True)
+        paid_off = np.flatnonzero(loan["loan_balance"] == 0)[0]
+        self.assertLess(paid_off, 12 * 5)
+        self.assertTrue((loan["interest_exp"][paid_off + 1:] == 0).all())
+        self.assertTrue((loan["extra_payments_exp"][paid_off + 1:] == 0).all())
+
+
+class TestMonthlySim(unittest.TestCase):
+
+    def test_to_df_is_lazy_and_cached(self):
+        monthly_sim = get_monthly_sim(Inputs(), extra_payments=True)
+        self.assertIsNone(monthly_sim._df)
+        self.assertIs(monthly_sim.to_df(), monthly_sim.to_df())
+        self.assertEqual(len(monthly_sim.to_df()), len(monthly_sim))
+
+    def test_yearly_agg_from_columnar(self):
+        for kwargs in SCENARIOS:
+            inputs = Inputs(**kwargs)
+            monthly_sim = get_monthly_sim(inputs, extra_payments=True)
+            pd.testing.assert_frame_equal(
+                get_yearly_agg_df(inputs, monthly_sim.to_df()),
+                get_yearly_agg_df(inputs, monthly_sim),
+                check_dtype=False
+            )
+
+
+class TestBatchSimulation(unittest.TestCase):
+
+    def test_batch_matches_scalar(self):
+        inputs_list = [Inputs(**kwargs) for kwargs in SCENARIOS]
+        batch_results = get_batch_simulation_data(inputs_list)
+
+        for inputs, results in zip(inputs_list, batch_results):
+            expected = get_all_simulation_data(inputs)
+            self.assertEqual(expected.keys(), results.keys())
+            pd.testing.assert_frame_equal(expected["yearly_df"], results["yearly_df"], check_dtype=False)
+            for name, value in expected["mortgage_metrics"].items():
+                self.assertAlmostEqual(value, results["mortgage_metrics"][name], places=4)
+            if "extra_payments_comparison" in expected:
+                pd.testing.assert_frame_equal(
+                    expected["extra_payments_comparison"],
+                    results["extra_payments_comparison"],
+                    check_dtype=False
+                )
+
+    def test_batch_stacked(self):
+        inputs_list = [Inputs(**kwargs) for kwargs in SCENARIOS]
+        stacked = get_batch_simulation_data(inputs_list, stacked=True)
+
+        self.assertEqual(stacked["yearly_df"].index.names, ["scenario", "year"])
+        self.assertEqual(len(stacked["yearly_df"]), 30 * len(SCENARIOS))
+        self.assertEqual(len(stacked["mortgage_metrics"]), len(SCENARIOS))
+        # Scenario 1 has no extra payments so it has no comparison rows
+        self.assertNotIn(1, stacked["extra_payments_comparison"].index.get_level_values("scenario"))
+
+
+class TestMonteCarlo(unittest.TestCase):
+
+    MODELS = {
+        "yr_home_appreciation": LognormalModel(mean=0.03, volatility=0.08),
+        "rent_surplus_portfolio_growth": BootstrapModel(history=[0.12, -0.08, 0.21, 0.03, 0.07]),
+    }
+
+    def test_without_models_matches_deterministic(self):
+        for kwargs in SCENARIOS:
+            inputs = Inputs(**kwargs)
+            yearly = get_monte_carlo_yearly_arrays(inputs, {}, n_paths=3, metrics=["ownership_upside", "equity"])
+            yearly_df = get_all_simulation_data(inputs)["yearly_df"]
+            for metric, values in yearly.items():
+                np.testing.assert_allclose(values, np.tile(yearly_df[metric], (3, 1)), atol=1e-6)
+
+    def test_seeded_and_chunk_independent(self):
+        inputs = Inputs()
+        first = get_monte_carlo_simulation_data(inputs, self.MODELS, n_paths=500, seed=7, chunk_size=500)
+        second = get_monte_carlo_simulation_data(inputs, self.MODELS, n_paths=500, seed=7, chunk_size=123)
+        pd.testing.assert_frame_equal(first["percentiles_df"], second["percentiles_df"])
+        pd.testing.assert_series_equal(first["prob_positive_upside"], second["prob_positive_upside"])
+
+        bands = first["percentiles_df"]["ownership_upside"]
+        self.assertTrue((bands[5] <= bands[50]).all() and (bands[50] <= bands[95]).all())
+
+
+class TestSweep(unittest.TestCase):
+
+    RANGES = {
+        "down_payment": [20000, 60000],
+        "interest_rate": [0.05, 0.07],
+        "mo_extra_payment": [0, 300],
+    }
+
+    def test_sweep_matches_scalar(self):
+        sweep_df = run_sweep(Inputs(), self.RANGES, chunk_size=3)
+        self.assertEqual(sweep_df["point"].nunique(), 8)
+
+        point = sweep_df[sweep_df["point"] == 5].set_index("metric")
+        inputs = Inputs(down_payment=60000, interest_rate=0.05, mo_extra_payment=300)
+        results = get_all_simulation_data(inputs)
+        for name, value in results["mortgage_metrics"].items():
+            self.assertAlmostEqual(point.loc[name, "value"], value, places=4)
+        self.assertAlmostEqual(
+            point.loc["Final Ownership Upside", "value"],
+            results["yearly_df"]["ownership_upside"].iloc[-1],
+            places=4
+        )
+
+    def test_sweep_independent_of_workers(self):
+        inline = run_sweep(Inputs(), self.RANGES, n_workers=1, chunk_size=8)
+        pooled = run_sweep(Inputs(), self.RANGES, n_workers=2, chunk_size=3)
+        pd.testing.assert_frame_equal(inline, pooled)
+
+    def test_derived_fields_rejected(self):
+        with self.assertRaises(ValueError):
+            run_sweep(Inputs(), {"loan_amount": [100000]})
+
+
+class TestSolver(unittest.TestCase):
+
+    def test_break_even_rent(self):
+        inputs = Inputs()
+        rent = solve_break_even(inputs, "mo_rent_comparison_exp", target_year=7, lower=500, upper=6000)
+        upside = get_all_simulation_data(replace(inputs, mo_rent_comparison_exp=rent))["yearly_df"]["ownership_upside"]
+        self.assertAlmostEqual(upside[7], 0, places=1)
+
+    def test_batch_matches_single(self):
+        homes = [Inputs(home_price=price) for price in [200000, 400000, 800000]]
+        rents = solve_break_even_batch(homes, "mo_rent_comparison_exp", target_year=10, lower=200, upper=20000)
+        for inputs, rent in zip(homes, rents):
+            expected = solve_break_even(inputs, "mo_rent_comparison_exp", target_year=10, lower=200, upper=20000)
+            self.assertAlmostEqual(rent, expected, places=2)
+
+    def test_no_sign_change(self):
+        rent = solve_break_even(Inputs(), "mo_rent_comparison_exp", target_year=7, lower=100, upper=200)
+        self.assertTrue(np.isnan(rent))
+
+
+class TestSimulationCache(unittest.TestCase):
+
+    def test_canonical_key(self):
+        self.assertEqual(get_inputs_key(Inputs(home_price=300000)), get_inputs_key(Inputs(home_price=300000.0)))
+        self.assertNotEqual(get_inputs_key(Inputs()), get_inputs_key(Inputs(down_payment=60000)))
+
+    def test_hits_and_eviction(self):
+        entry_nbytes = get_results_nbytes(get_all_simulation_data(Inputs()))
+        cache = SimulationCache(max_bytes=2 * entry_nbytes)
+
+        first = cache.get_all_simulation_data(Inputs(down_payment=20000))
+        self.assertIs(cache.get_all_simulation_data(Inputs(down_payment=20000)), first)
+        cache.get_all_simulation_data(Inputs(down_payment=30000))
+        cache.get_all_simulation_data(Inputs(down_payment=40000))
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 3, 2))
+        self.assertIsNone(cache.get(Inputs(down_payment=20000)))
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            expected = SimulationCache(cache_dir=cache_dir).get_all_simulation_data(Inputs())
+            cache = SimulationCache(cache_dir=cache_dir)
+            results = cache.get_all_simulation_data(Inputs())
+
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            self.assertEqual(cache.stats()["misses"], 0)
+            pd.testing.assert_frame_equal(expected["yearly_df"], results["yearly_df"])
+            pd.testing.assert_frame_equal(expected["extra_payments_comparison"], results["extra_payments_comparison"])
+            self.assertEqual(expected["mortgage_metrics"], results["mortgage_metrics"])
+
+    def test_disk_tier_version(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            SimulationCache(cache_dir=cache_dir).get_all_simulation_data(Inputs())
+
+            # Files written by an older version are recomputed and overwritten
+            with mock.patch("mortgage_calculator.cache.CACHE_VERSION", CACHE_VERSION + 1):
+                cache = SimulationCache(cache_dir=cache_dir)
+                cache.get_all_simulation_data(Inputs())
+                self.assertEqual((cache.stats()["disk_hits"], cache.stats()["misses"]), (0, 1))
+
+                cache = SimulationCache(cache_dir=cache_dir)
+                cache.get_all_simulation_data(Inputs())
+                self.assertEqual((cache.stats()["disk_hits"], cache.stats()["misses"]), (1, 0))
+
+
+class TestStageCache(unittest.TestCase):
+
+    def test_rent_sweep_reuses_schedules(self):
+        stage_cache = StageCache()
+        for rent in [1000, 1500, 2000]:
+            inputs = Inputs(mo_rent_comparison_exp=rent)
+            results = get_all_simulation_data(inputs, stage_cache=stage_cache)
+            pd.testing.assert_frame_equal(results["yearly_df"], get_all_simulation_data(inputs)["yearly_df"])
+
+        stats = stage_cache.stats()
+        self.assertEqual(stats["home"], {"hits": 2, "misses": 1, "entries": 1})
+        # Loan with and without extra payments
+        self.assertEqual(stats["loan"], {"hits": 4, "misses": 2, "entries": 2})
+
+    def test_new_loan_terms_miss(self):
+        stage_cache = StageCache()
+        get_monthly_sim(Inputs(interest_rate=0.05), stage_cache=stage_cache)
+        get_monthly_sim(Inputs(interest_rate=0.06), stage_cache=stage_cache)
+        self.assertEqual(stage_cache.stats()["loan"]["misses"], 2)
+        self.assertEqual(stage_cache.stats()["home"]["hits"], 1)
+
+
+class TestSimulationSession(unittest.TestCase):
+
+    def assert_matches_full_run(self, session):
+        expected = get_all_simulation_data(session.inputs)
+        results = session.results
+        self.assertEqual(expected.keys(), results.keys())
+        pd.testing.assert_frame_equal(expected["yearly_df"], results["yearly_df"])
+        if "extra_payments_comparison" in expected:
+            pd.testing.assert_frame_equal(expected["extra_payments_comparison"], results["extra_payments_comparison"])
+
+    def test_updates_match_full_run(self):
+        session = SimulationSession(Inputs())
+        changes = [
+            {"mo_rent_comparison_exp": 1800},
+            {"rent_surplus_portfolio_growth": 0.06},
+            {"down_payment": 15000},
+            {"yr_home_appreciation": 0.0},
+            {"mo_extra_payment": 0},
+            {"num_extra_payments": 24, "mo_extra_payment": 500},
+            {"capital_gains_tax_rate": 0.2},
+            {"loan_term_years": 15},
+            {"horizon_years": 7},
+        ]
+        for change in changes:
+            session.update(**change)
+            self.assert_matches_full_run(session)
+
+    def test_rent_only_touches_rent_stages(self):
+        self.assertEqual(
+            get_dirty_stages(["mo_rent_comparison_exp"]),
+            ["rent_comparison_exp", "rent_comparison_portfolio", "yearly"]
+        )
+        self.assertIn("loan", get_dirty_stages(["down_payment"]))
+
+
+class TestListings(unittest.TestCase):
+
+    COLUMN_MAP = {"price": "home_price", "hoa": "mo_hoa_fees", "rent": "mo_rent_comparison_exp"}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_path = f"{self.tmp_dir.name}/listings.csv"
+        self.output_path = f"{self.tmp_dir.name}/metrics.csv"
+        pd.DataFrame({
+            "price": [250000, 400000, 320000, 610000, 180000],
+            "hoa": [0, 150, np.nan, 300, 50],
+            "rent": [1500, 2400, 2000, 3200, 1200],
+        }).to_csv(self.input_path, index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_matches_single_simulation(self):
+        self.assertEqual(evaluate_listings(self.input_path, self.output_path, self.COLUMN_MAP, chunk_size=2), 5)
+        out_df = pd.read_csv(self.output_path, index_col="row")
+        self.assertEqual(list(out_df.index), [0, 1, 2, 3, 4])
+
+        # A missing hoa falls back to the base inputs
+        inputs = Inputs(home_price=320000, mo_rent_comparison_exp=2000)
+        results = get_all_simulation_data(inputs)
+        row = out_df.loc[2]
+        self.assertAlmostEqual(row["Total Interest Paid"], results["mortgage_metrics"]["Total Interest Paid"], places=4)
+        self.assertAlmostEqual(row["Final Ownership Upside"], results["yearly_df"]["ownership_upside"].iloc[-1], places=4)
+        self.assertTrue(out_df["error"].isna().all())
+
+    def test_invalid_listings_are_reported(self):
+        pd.DataFrame({
+            "price": ["250000", "unknown", "320000"],
+            "term": [30, 30, 12.5],
+        }).to_csv(self.input_path, index=False)
+        column_map = {"price": "home_price", "term": "loan_term_years"}
+        self.assertEqual(evaluate_listings(self.input_path, self.output_path, column_map, chunk_size=2), 3)
+
+        out_df = pd.read_csv(self.output_path, index_col="row")
+        self.assertIn("home_price must be a number", out_df.loc[1, "error"])
+        self.assertIn("loan_term_years", out_df.loc[2, "error"])
+        self.assertTrue(out_df.loc[[1, 2], "Total Interest Paid"].isna().all())
+        expected = get_all_simulation_data(Inputs(home_price=250000))["mortgage_metrics"]["Total Interest Paid"]
+        self.assertAlmostEqual(out_df.loc[0, "Total Interest Paid"], expected, places=4)
+
+    def test_cli_field_errors(self):
+        for argument in ["use_tax_model=maybe", "home_price=abc", "loan_amount=1", "home_price"]:
+            with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+                listings_main([self.input_path, self.output_path, "--set", argument])
+
+    def test_resume_after_interruption(self):
+        evaluate_listings(self.input_path, self.output_path, self.COLUMN_MAP, chunk_size=2)
+        expected = pd.read_csv(self.output_path)
+
+        # Roll back to one completed chunk with a partially written one after it
+        with open(self.output_path) as f:
+            lines = f.readlines()
+        with open(self.output_path, "w") as f:
+            f.writelines(lines[:3])
+            output_bytes = f.tell()
+            f.write(lines[3][:10])
+        with open(self.output_path + ".progress", "w") as f:
+            f.write(f'{{"completed_chunks": 1, "output_bytes": {output_bytes}, "chunk_size": 2}}')
+
+        self.assertEqual(evaluate_listings(self.input_path, self.output_path, self.COLUMN_MAP, chunk_size=2, resume=True), 3)
+        pd.testing.assert_frame_equal(pd.read_csv(self.output_path), expected)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_engines_match_reference_loop(self):
+        self.assertEqual(check_equivalence(get_random_inputs(20, seed=1)), [])
+
+    def test_run_benchmark(self):
+        result = run_benchmark("get_all_simulation_data", 1, repeat=1)
+        self.assertGreater(result["wall_time_s"], 0)
+        self.assertGreater(result["alloc_peak_bytes"], 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {"results": [{"name": "batch", "n_scenarios": 1000, "wall_time_s": 1.0, "alloc_peak_bytes": 100, "peak_rss_bytes": None}]}
+        current = {"results": [{"name": "batch", "n_scenarios": 1000, "wall_time_s": 1.5, "alloc_peak_bytes": 105, "peak_rss_bytes": None}]}
+        regressions = compare_results(baseline, current, threshold=0.1)
+        self.assertEqual([r["metric"] for r in regressions], ["wall_time_s"])
+        self.assertEqual(compare_results(baseline, current, threshold=0.6), [])
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_reports_every_stage(self):
+        with profile_stages() as profile:
+            get_all_simulation_data(Inputs())
+        stages = profile.to_dict()
+        self.assertEqual(list(stages), [
+            "home_schedule",
+            "loan_schedule",
+            "assemble_monthly_sim",
+            "yearly_aggregation",
+            "yearly_df",
+            "mortgage_metrics",
+            "baseline_loan_schedule",
+            "extra_payments_comparison",
+            "extra_payments_comparison_df",
+        ])
+        self.assertEqual(stages["assemble_monthly_sim"]["rows"], 360)
+        self.assertEqual(stages["yearly_df"]["rows"], 30)
+        self.assertFalse(is_profiling())
+
+    def test_custom_sink(self):
+        received = []
+        with profile_stages(lambda stage, seconds, rows: received.append((stage, rows))):
+            get_monthly_sim_df(Inputs())
+        self.assertEqual(received[-1], ("monthly_df", 360))
+
+
+class TestLoanTermAndHorizon(unittest.TestCase):
+
+    def test_term_sets_payment(self):
+        inputs = Inputs(loan_term_years=15)
+        self.assertAlmostEqual(inputs.mo_amortized, get_amortization_payment(inputs.loan_amount, inputs.interest_rate, 15))
+        with self.assertRaises(ValueError):
+            Inputs(loan_term_years=0)
+        with self.assertRaises(ValueError):
+            Inputs(horizon_years=41)
+
+    def test_simulation_stops_at_horizon(self):
+        inputs = Inputs(horizon_years=7)
+        self.assertEqual(len(get_monthly_sim_df(inputs)), 84)
+        self.assertEqual(list(get_all_simulation_data(inputs)["yearly_df"].index), list(range(7)))
+
+    def test_whole_number_floats(self):
+        inputs = Inputs(horizon_years=7.0, loan_term_years=15.0)
+        self.assertEqual((inputs.horizon_years, inputs.loan_term_years), (7, 15))
+        self.assertIsInstance(inputs.horizon_years, int)
+        pd.testing.assert_frame_equal(
+            get_all_simulation_data(inputs)["yearly_df"],
+            get_all_simulation_data(Inputs(horizon_years=7, loan_term_years=15))["yearly_df"]
+        )
+
+        yearly = get_monte_carlo_yearly_arrays(inputs, {"yr_home_appreciation": LognormalModel(0.03, 0.1)}, n_paths=10, seed=0)
+        self.assertEqual(yearly["ownership_upside"].shape, (10, 7))
+
+        # The CLI parses every number as a float
+        with redirect_stdout(io.StringIO()) as stdout:
+            core_main(["--set", "horizon_years=7"])
+        self.assertIn("Final Ownership Upside", stdout.getvalue())
+
+    def test_loan_is_paid_off_after_term(self):
+        for extra_payments in [False, True]:
+            sim = get_monthly_sim(Inputs(loan_term_years=15, horizon_years=20), extra_payments)
+            np.testing.assert_allclose(sim["loan_balance"][179], 0, atol=1e-6)
+            for col in ["interest_exp", "principal_exp", "extra_payments_exp", "loan_balance"]:
+                self.assertTrue((sim[col][180:] == 0).all())
+
+    def test_matches_loop_and_batch(self):
+        inputs_list = [
+            Inputs(loan_term_years=term, horizon_years=horizon, **kwargs)
+            for term in [10, 15, 30]
+            for horizon in [1, 7, 40]
+            for kwargs in SCENARIOS
+        ]
+        for inputs in inputs_list:
+            for extra_payments in [False, True]:
+                pd.testing.assert_frame_equal(
+                    get_monthly_sim_loop(inputs, extra_payments).to_df(),
+                    get_monthly_sim_df(inputs, extra_payments),
+                    rtol=1e-9,
+                    atol=1e-6,
+                )
+        for inputs, results in zip(inputs_list, get_batch_simulation_data(inputs_list)):
+            pd.testing.assert_frame_equal(get_all_simulation_data(inputs)["yearly_df"], results["yearly_df"], rtol=1e-9, atol=1e-6)
+
+
+class TestRefinance(unittest.TestCase):
+
+    def test_suffix_matches_full_simulation(self):
+        for kwargs in SCENARIOS:
+            inputs = Inputs(**kwargs)
+            checkpoint = get_refinance_checkpoint(inputs)
+            for month in [0, 13, 100]:
+                refinance = Refinance(month, 0.04, term_years=15)
+                sim = get_refinance_monthly_sim(checkpoint, refinance)
+
+                # Rerun everything on the spliced loan
+                loan = {
+                    col: np.concatenate([checkpoint.monthly[col][:month], values])
+                    for col, values in get_refinanced_loan_schedule(checkpoint, refinance).items()
+                }
+                expected = assemble_monthly_sim(inputs, get_home_schedule(inputs), loan)
+                for col in MONTHLY_COLUMNS:
+                    np.testing.assert_allclose(sim[col], expected[col], rtol=1e-9, atol=1e-6, err_msg=col)
+
+    def test_closing_costs(self):
+        checkpoint = get_refinance_checkpoint(Inputs())
+        sim = get_refinance_monthly_sim(checkpoint, Refinance(30, 0.04))
+        sim_with_costs = get_refinance_monthly_sim(checkpoint, Refinance(30, 0.04, closing_costs=3000))
+        difference = sim_with_costs["ownership_exp"] - sim["ownership_exp"]
+        self.assertAlmostEqual(difference[30], 3000)
+        self.assertEqual(np.count_nonzero(difference), 1)
+
+    def test_same_rate_at_closing_changes_nothing(self):
+        inputs = Inputs(down_payment=15000)
+        sim = get_refinance_monthly_sim(get_refinance_checkpoint(inputs), Refinance(0, inputs.interest_rate))
+        expected = get_monthly_sim(inputs, extra_payments=True)
+        for col in MONTHLY_COLUMNS:
+            np.testing.assert_allclose(sim[col], expected[col], rtol=1e-12, err_msg=col)
+
+    def test_optimal_refinance(self):
+        result = get_optimal_refinance(Inputs(horizon_years=10), [0.04, 0.09], closing_costs=5000, months=range(0, 120, 12))
+        self.assertGreater(result.loc[0.04, "upside_gain"], 0)
+        self.assertGreaterEqual(result.loc[0.04, "break_even_month"], result.loc[0.04, "optimal_month"])
+        self.assertTrue(np.isnan(result.loc[0.09, "optimal_month"]))
+
+        # The default grid starts after closing
+        result = get_optimal_refinance(Inputs(horizon_years=5), [0.04], closing_costs=5000)
+        self.assertEqual(result.loc[0.04, "optimal_month"], 1)
+
+
+class TestCompactResults(unittest.TestCase):
+
+    def test_inputs_are_slotted_and_frozen(self):
+        inputs = Inputs()
+        self.assertFalse(hasattr(inputs, "__dict__"))
+        with self.assertRaises(AttributeError):
+            inputs.home_price = 400000
+        self.assertEqual(hash(inputs), hash(Inputs()))
+        self.assertEqual(pickle.loads(pickle.dumps(inputs)), inputs)
+        self.assertEqual(replace(inputs, home_price=400000).loan_amount, 350000)
+
+    def test_input_groups_on_their_own(self):
+        mortgage = MortgageInputs(home_price=400000)
+        self.assertEqual(mortgage.loan_amount, Inputs(home_price=400000).loan_amount)
+        self.assertFalse(hasattr(mortgage, "__dict__"))
+        with self.assertRaises(AttributeError):
+            mortgage.home_price = 500000
+        self.assertEqual(ExpensesInputs().mo_utility, Inputs().mo_utility)
+        self.assertEqual(TaxInputs(tax_year=2024).tax_year, 2024)
+
+    def test_matches_batch_results(self):
+        inputs_list = [Inputs(horizon_years=7, **kwargs) for kwargs in SCENARIOS] + [Inputs(**kwargs) for kwargs in SCENARIOS]
+        results = get_simulation_results(inputs_list, chunk_size=3)
+        for i, expected in enumerate(get_batch_simulation_data(inputs_list)):
+            actual = results.get_results(i)
+            self.assertEqual(expected.keys(), actual.keys())
+            pd.testing.assert_frame_equal(expected["yearly_df"], actual["yearly_df"])
+            self.assertEqual(expected["mortgage_metrics"], actual["mortgage_metrics"])
+        pd.testing.assert_frame_equal(
+            results.get_monthly_df(0),
+            get_monthly_sim_df(inputs_list[0], extra_payments=True),
+            rtol=1e-9,
+            atol=1e-6,
+        )
+
+    def test_float32_summary_only(self):
+        inputs_list = [Inputs(**kwargs) for kwargs in SCENARIOS]
+        full = get_simulation_results(inputs_list)
+        compact = get_simulation_results(inputs_list, summary_only=True, dtype=np.float32)
+        self.assertIsNone(compact.monthly)
+        self.assertLess(compact.nbytes * 10, full.nbytes)
+        with self.assertRaises(ValueError):
+            compact.get_monthly_df(0)
+        np.testing.assert_allclose(compact.yearly, full.yearly, rtol=2**-24)
+
+
+class TestPortfolio(unittest.TestCase):
+
+    def test_single_property_matches_simulation(self):
+        inputs = Inputs(horizon_years=5)
+        results = simulate_portfolio([Property(inputs, start_month=6)])
+        monthly = get_monthly_sim(inputs, extra_payments=True)
+        monthly_df = results["monthly_df"]
+
+        self.assertEqual(len(monthly_df), 66)
+        np.testing.assert_allclose(monthly_df["property_exp"][6:], monthly["total_exp"], rtol=1e-9)
+        np.testing.assert_allclose(monthly_df["loan_balance"][6:-1], monthly["loan_balance"][:-1], rtol=1e-9)
+        self.assertEqual(monthly_df["purchases"][6], inputs.cash_outlay)
+
+        # The sale matches the yearly net worth terms, until then the investor funds everything
+        yearly = get_all_simulation_data(inputs)["yearly_df"].iloc[-1]
+        expected_proceeds = yearly["equity"] - yearly["realtor_fee"] - yearly["total_gains"] * inputs.capital_gains_tax_rate
+        self.assertAlmostEqual(monthly_df["sale_proceeds"].iloc[-1], expected_proceeds, places=4)
+        self.assertAlmostEqual(
+            monthly_df["external_contributions"][:-1].sum(),
+            inputs.cash_outlay + monthly["total_exp"][:-1].sum(),
+            places=4
+        )
+
+    def test_equity_draw_funds_next_purchase(self):
+        first = Inputs(horizon_years=10, down_payment=100000)
+        second = Inputs(horizon_years=10)
+        properties = [Property(first, mo_rental_income=2500), Property(second, start_month=24, mo_rental_income=2500)]
+
+        without_draw = simulate_portfolio(properties)
+        with_draw = simulate_portfolio(properties, [EquityDraw(month=24, property=0, amount=second.cash_outlay)])
+
+        self.assertLess(with_draw["monthly_df"]["external_contributions"][24], without_draw["monthly_df"]["external_contributions"][24])
+        loan_balance = with_draw["property_arrays"]["loan_balance"][0]
+        self.assertGreater(loan_balance[24], without_draw["property_arrays"]["loan_balance"][0][24] + 0.9 * second.cash_outlay)
+
+        with self.assertRaises(ValueError):
+            simulate_portfolio(properties, [EquityDraw(month=200, property=0, amount=1000)])
+        with self.assertRaises(ValueError):
+            simulate_portfolio([Property(Inputs(horizon_years=5), start_month=-3)])
+
+
+class TestService(unittest.TestCase):
+
+    def run_requests(self, service, inputs_list):
+        async def run():
+            try:
+                return await asyncio.gather(*(service.simulate(inputs) for inputs in inputs_list), return_exceptions=True)
+            finally:
+                service.close()
+        return asyncio.run(run())
+
+    def test_coalesces_identical_requests(self):
+        service = SimulationService(ThreadPoolExecutor(1), max_workers=1)
+        inputs = Inputs(horizon_years=10)
+        bodies = self.run_requests(service, [inputs] * 20)
+
+        self.assertEqual(len(set(bodies)), 1)
+        self.assertEqual(service.stats()["coalesced"], 19)
+        self.assertEqual(service.batched_inputs, 1)
+
+        payload = json.loads(bodies[0])
+        expected = get_all_simulation_data(inputs)
+        np.testing.assert_allclose(payload["yearly_df"]["ownership_upside"], expected["yearly_df"]["ownership_upside"], rtol=1e-9)
+        np.testing.assert_allclose(
+            payload["extra_payments_comparison"]["interest_saved"],
+            expected["extra_payments_comparison"]["interest_saved"],
+            rtol=1e-9, atol=1e-6
+        )
+
+    def test_micro_batches_and_backpressure(self):
+        inputs_list = [Inputs(home_price=200000 + 1000 * i) for i in range(10)]
+
+        service = SimulationService(ThreadPoolExecutor(1), max_workers=1, max_batch_size=4)
+        bodies = self.run_requests(service, inputs_list)
+        self.assertEqual(service.batches, 3)
+        self.assertEqual(len(set(bodies)), 10)
+
+        service = SimulationService(ThreadPoolExecutor(1), max_workers=1, max_pending=4)
+        bodies = self.run_requests(service, inputs_list)
+        self.assertEqual(sum(isinstance(body, ServiceOverloaded) for body in bodies), 6)
+        self.assertEqual(service.stats()["rejected"], 6)
+
+    def test_bad_input_only_fails_itself(self):
+        # Valid when built, but its tax table is gone by the time it is simulated
+        register_tax_table(replace(get_tax_table(2025), year=2099))
+        bad = Inputs(use_tax_model=True, tax_year=2099)
+        unregister_tax_table(2099)
+
+        service = SimulationService(ThreadPoolExecutor(1), max_workers=1)
+        good_body, error = self.run_requests(service, [Inputs(home_price=350000), bad])
+        self.assertEqual((service.batches, service.batched_inputs, service.errors), (1, 2, 1))
+        self.assertIsInstance(error, ValueError)
+        self.assertEqual(json.loads(good_body), json.loads(simulate_batch([Inputs(home_price=350000)])[0]))
+
+    def test_handle_request(self):
+        async def run(method, path, payload):
+            service = SimulationService(ThreadPoolExecutor(1), max_workers=1)
+            try:
+                return await handle_request(service, method, path, json.dumps(payload).encode())
+            finally:
+                service.close()
+
+        status, body = asyncio.run(run("POST", "/simulate", get_inputs_payload(Inputs(horizon_years=3))))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["yearly_df"]["year"], [0, 1, 2])
+
+        self.assertEqual(asyncio.run(run("POST", "/simulate", {"cash_outlay": 1}))[0], 400)
+        self.assertEqual(asyncio.run(run("POST", "/simulate", {"horizon_years": 100}))[0], 400)
+        self.assertEqual(asyncio.run(run("POST", "/simulate", {"mo_hoa_fees": [1]}))[0], 400)
+        self.assertEqual(asyncio.run(run("POST", "/simulate", {"use_tax_model": 1}))[0], 400)
+        self.assertEqual(asyncio.run(run("POST", "/simulate", {"use_tax_model": True, "tax_year": 1999}))[0], 400)
+        self.assertEqual(asyncio.run(run("GET", "/simulate", {}))[0], 405)
+        self.assertEqual(asyncio.run(run("GET", "/unknown", {}))[0], 404)
+
+
+class TestTaxModel(unittest.TestCase):
+
+    def test_unknown_tax_year(self):
+        with self.assertRaises(ValueError):
+            Inputs(use_tax_model=True, tax_year=1999)
+
+        # Without the tax model the year is never read, also not in a batch with the tax model on
+        results = get_batch_simulation_data([Inputs(use_tax_model=True), Inputs(tax_year=1999)])
+        pd.testing.assert_frame_equal(results[1]["yearly_df"], get_all_simulation_data(Inputs())["yearly_df"])
+
+        chunk = pd.DataFrame({"year": [2025, 1999], "taxed": [True, True]})
+        out_df = evaluate_listings_chunk(chunk, {"year": "tax_year", "taxed": "use_tax_model"}, Inputs())
+        self.assertEqual(out_df["error"][0], "")
+        self.assertIn("No tax table for 1999", out_df["error"][1])
+
+    def test_bracket_tax(self):
+        params = get_tax_params(2024, False)
+        self.assertAlmostEqual(get_bracket_tax(100000, params["income_thresholds"], params["income_steps"]), 17053)
+        self.assertAlmostEqual(get_bracket_tax(0, params["income_thresholds"], params["income_steps"]), 0)
+
+        # Tables of different years and filing statuses are selected per scenario
+        params = get_tax_params(np.array([[2024], [2025]]), np.array([[1], [0]]))
+        np.testing.assert_array_equal(params["standard_deduction"], [[29200], [15750]])
+        self.assertEqual(params["income_thresholds"].shape, (2, 1, 7))
+
+    def test_deductions(self):
+        yearly = get_all_simulation_data(Inputs())["yearly_df"]
+        self.assertTrue((yearly["tax_savings"] == 0).all())
+
+        # Interest and SALT beat the single standard deduction but not the joint one
+        single = get_all_simulation_data(Inputs(use_tax_model=True, married_filing_jointly=False))["yearly_df"]
+        joint = get_all_simulation_data(Inputs(use_tax_model=True))["yearly_df"]
+        self.assertGreater(single["tax_savings"][0], 0)
+        self.assertEqual(joint["tax_savings"][0], 0)
+
+        # Tables are pluggable, without a standard deduction owning saves taxes for joint filers too
+        register_tax_table(replace(get_tax_table(2025), year=2099, standard_deduction=(0, 0)))
+        self.addCleanup(unregister_tax_table, 2099)
+        custom = get_all_simulation_data(Inputs(use_tax_model=True, tax_year=2099))["yearly_df"]
+        self.assertGreater(custom["tax_savings"][0], 0)
+        np.testing.assert_allclose(
+            custom["net_worth_from_owning"] - custom["tax_savings_cumulative"],
+            joint["net_worth_from_owning"] - joint["tax_savings_cumulative"],
+            rtol=1e-9
+        )
+        unregister_tax_table(2099)
+        with self.assertRaises(ValueError):
+            get_tax_table(2099)
+
+        # The pandas aggregation matches the array one
+        inputs = Inputs(use_tax_model=True, married_filing_jointly=False)
+        pd.testing.assert_frame_equal(get_yearly_agg_df(inputs, get_monthly_sim_df(inputs, True))[single.columns], single, check_dtype=False, rtol=1e-9)
+
+    def test_home_sale_exclusion(self):
+        inputs = Inputs(use_tax_model=True, horizon_years=5, yr_home_appreciation=0.15)
+
+        def get_home_sale_tax(inputs):
+            yearly = get_yearly_agg_arrays(inputs, get_monthly_sim(inputs, extra_payments=True).columns)
+            return get_yearly_taxes(inputs, yearly)["home_sale_tax"]
+
+        # The gains stay under the joint exclusion, which only applies after 2 years
+        home_sale_tax = get_home_sale_tax(inputs)
+        self.assertGreater(home_sale_tax[0], 0)
+        np.testing.assert_array_equal(home_sale_tax[1:], 0)
+
+        home_sale_tax = get_home_sale_tax(replace(inputs, primary_residence=False))
+        self.assertTrue(np.all(np.diff(home_sale_tax) > 0))
+
+        # No deduction for a loss
+        np.testing.assert_array_equal(get_home_sale_tax(replace(inputs, yr_home_appreciation=-0.02)), 0)
+
+
+class TestLightweightCore(unittest.TestCase):
+
+    def test_cold_start_skips_lazy_modules(self):
+        # Timings are left to `benchmark imports`, they are too noisy for the unit tests
+        for name, (statement, _) in IMPORT_BUDGETS.items():
+            self.assertEqual(measure_cold_start(statement, repeat=1)["lazy_modules"], [], name)
+
+    def test_array_modules_skip_pandas(self):
+        modules = ["monte_carlo", "sweep", "session", "refinance", "portfolio", "listings"]
+        statement = "; ".join(f"import mortgage_calculator.{module}" for module in modules)
+        self.assertEqual(measure_cold_start(statement, repeat=1)["lazy_modules"], [])
+
+    def test_arrays_match_frames(self):
+        inputs = Inputs(mo_extra_payment=500, num_extra_payments=60)
+        arrays = get_simulation_arrays(inputs)
+        results = get_all_simulation_data(inputs)
+
+        self.assertEqual(list(arrays["yearly"]), list(results["yearly_df"].columns))
+        np.testing.assert_array_equal(arrays["yearly"]["ownership_upside"], results["yearly_df"]["ownership_upside"])
+        np.testing.assert_array_equal(
+            arrays["extra_payments_comparison"]["interest_saved"],
+            results["extra_payments_comparison"]["interest_saved"]
+        )
+
+        summary = get_simulation_summary(inputs)
+        self.assertEqual(summary["Monthly Payment"], inputs.mo_amortized)
+        self.assertEqual(summary["Total Interest Paid"], results["mortgage_metrics"]["Total Interest Paid"])
+        self.assertEqual(summary["Final Ownership Upside"], results["yearly_df"]["ownership_upside"].iloc[-1])
+
+
 if __name__ == '__main__':
     unittest.main()